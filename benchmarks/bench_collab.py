@@ -0,0 +1,240 @@
+"""Load test for shared drawing sessions (doodle_collab), entirely on localhost.
+
+Starts a session server, then connects:
+
+* streamers   - simulated clients that only stream strokes (random walks,
+                as in bench_suite) at a steady pace and time how long each
+                takes to come back numbered from the server; they do not
+                rasterise, so many of them fit in one process
+* peers       - full peers with their own engine, which apply everything
+                the server sends and draw fills, background changes and the
+                occasional clear of their own
+* late joiner - a full peer that connects halfway through and has to catch
+                up from a snapshot and the operations after it
+
+Once everything has been sent and applied, every peer's drawing must be
+identical to replaying the server's order from a blank canvas; the exit
+status is 1 if any is not.  Results are printed as JSON: operations per
+second through the server, round-trip latency percentiles, bytes on the
+wire per operation (next to the same operation as JSON) and how long the
+late joiner took to catch up.  Everything shares one process and one GIL,
+so the latencies include waiting for the peers' rasterising:
+
+    python benchmarks/bench_collab.py
+    python benchmarks/bench_collab.py --streamers 100 --strokes 10 --peers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import ImageChops  # noqa: E402
+
+from bench_suite import COLORS, SIZES, peak_rss_kb, summarize  # noqa: E402
+from doodle_collab import Session, SessionClient, SessionServer, encode_operation  # noqa: E402
+from doodle_engine import DoodleEngine  # noqa: E402
+
+
+def random_stroke(rng, width, height, points):
+    x, y = rng.randrange(width), rng.randrange(height)
+    heading_x, heading_y = rng.uniform(-6, 6), rng.uniform(-6, 6)
+    line = [x, y]
+    for _ in range(points):
+        heading_x = max(-8, min(8, heading_x + rng.uniform(-2, 2)))
+        heading_y = max(-8, min(8, heading_y + rng.uniform(-2, 2)))
+        x = max(0, min(width - 1, round(x + heading_x)))
+        y = max(0, min(height - 1, round(y + heading_y)))
+        line.extend((x, y))
+    return {"op": "stroke", "tool": "eraser" if rng.random() < 0.2 else "brush", "color": rng.choice(COLORS),
+            "size": rng.choice(SIZES), "hardness": 1.0, "points": line}
+
+
+class Streamer:
+    """A client that sends strokes and times their round trip, without an engine.
+
+    It stands in for a Session: SessionClient sends what is in outgoing and
+    hands everything the server sends to on_message.
+    """
+
+    def __init__(self, strokes, keep_order=False):
+        self.strokes = strokes
+        self.outgoing = deque()
+        self.incoming = deque()
+        self.client_id = None
+        self.sent = deque()  # Send times of the strokes not back yet
+        self.latencies = []
+        self.order = [] if keep_order else None  # Every operation the server numbered, in order
+
+    def on_message(self):
+        now = time.perf_counter()
+        while self.incoming:
+            message = self.incoming.popleft()
+            if message[0] == "welcome":
+                self.client_id = message[1]
+            elif message[0] == "ordered":
+                for origin, operation in message[2]:
+                    if origin == self.client_id:
+                        self.latencies.append(now - self.sent.popleft())
+                    if self.order is not None:
+                        self.order.append(operation)
+
+    async def stream(self, interval, rng):
+        for operation in self.strokes:
+            await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+            self.sent.append(time.perf_counter())
+            self.outgoing.append(encode_operation(operation))
+
+
+async def peer_actions(session, count, interval, rng, width, height):
+    """A full peer's own drawing: fills and background changes, and a clear now and then"""
+    engine = session.engine
+    for i in range(count):
+        await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+        session.sync()
+        engine.current_color = rng.choice(COLORS)
+        if i % 10 == 9:
+            engine.clear()
+        elif i % 3 == 2:
+            engine.fill_background()
+        else:
+            engine.fill_shape(rng.randrange(width), rng.randrange(height))
+
+
+async def wait_until(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("the session did not settle")
+        await asyncio.sleep(0.01)
+
+
+async def run_load_test(args):
+    rng = random.Random(args.seed)
+    width = height = args.size
+    server = SessionServer(width, height, snapshot_every=args.snapshot_every)
+    await server.start("127.0.0.1", 0)
+    tasks = []
+
+    def connect(session):
+        # Full peers apply messages as they arrive, as the app does on its next frame
+        on_message = session.on_message if isinstance(session, Streamer) else session.sync
+        client = SessionClient(session, "127.0.0.1", server.port, on_message=on_message)
+        tasks.append(asyncio.create_task(client.run()))
+        return client
+
+    streamers = [Streamer([random_stroke(rng, width, height, args.points) for _ in range(args.strokes)],
+                          keep_order=(i == 0))
+                 for i in range(args.streamers)]
+    streamer_clients = [connect(streamer) for streamer in streamers]
+    peers = [Session(DoodleEngine(width, height)) for _ in range(args.peers)]
+    for peer in peers:
+        connect(peer)
+    await wait_until(lambda: all(client.connected for client in streamer_clients), args.timeout)
+
+    start = time.perf_counter()
+    interval = 1 / args.rate
+    work = [asyncio.create_task(streamer.stream(interval, random.Random(rng.random()))) for streamer in streamers]
+    pause = args.strokes * interval / max(args.peer_actions, 1)
+    work += [asyncio.create_task(peer_actions(peer, args.peer_actions, pause, random.Random(rng.random()), width, height))
+             for peer in peers]
+
+    # Halfway through, someone else joins
+    await asyncio.sleep(args.strokes * interval / 2)
+    late = Session(DoodleEngine(width, height))
+    join_start = time.perf_counter()
+    join_sequence = server.sequence
+    connect(late)
+    await wait_until(lambda: late.sequence >= join_sequence, args.timeout)
+    join_time = time.perf_counter() - join_start
+
+    await asyncio.gather(*work)
+    sessions = peers + [late]
+    await wait_until(lambda: all(not streamer.sent and not streamer.outgoing for streamer in streamers)
+                     and all(not peer.pending and not peer.outgoing for peer in sessions)
+                     and all(session.sequence == server.sequence for session in sessions), args.timeout)
+    await wait_until(lambda: len(streamers[0].order) == server.sequence, args.timeout)
+    elapsed = time.perf_counter() - start
+
+    # Everyone must hold exactly what the server's order gives
+    reference = DoodleEngine(width, height)
+    for operation in streamers[0].order:
+        reference.apply(operation)
+    expected = reference.image
+    consistent = [ImageChops.difference(expected, session.engine.image).getbbox(alpha_only=False) is None
+                  and session.engine.background == reference.background for session in sessions]
+
+    operations = streamers[0].order
+    binary = sum(len(encode_operation(operation)) for operation in operations)
+    as_json = sum(len(json.dumps(operation)) for operation in operations)
+    uploaded = sum(client.bytes_sent for client in streamer_clients)
+    downloaded = sum(client.bytes_received for client in streamer_clients) / len(streamer_clients)
+    results = {
+        "streamers": args.streamers,
+        "peers": args.peers,
+        "operations": server.sequence,
+        "seconds": round(elapsed, 3),
+        "operations_per_second": round(server.sequence / elapsed, 1),
+        "round_trip": summarize([latency for streamer in streamers for latency in streamer.latencies]),
+        "bytes_per_operation": round(binary / len(operations), 1),
+        "json_bytes_per_operation": round(as_json / len(operations), 1),
+        "upload_bytes_per_stroke": round(uploaded / (args.streamers * args.strokes), 1),
+        "download_bytes_per_client": round(downloaded),
+        "late_join_seconds": round(join_time, 4),
+        "late_join_operations": join_sequence,
+        "consistent": all(consistent),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await server.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--streamers", type=int, default=50, help="clients streaming strokes")
+    parser.add_argument("--strokes", type=int, default=20, help="strokes each streamer sends")
+    parser.add_argument("--points", type=int, default=40, help="points per stroke")
+    parser.add_argument("--rate", type=float, default=1, help="strokes per second from each streamer")
+    parser.add_argument("--peers", type=int, default=3, help="full peers that rasterise everything")
+    parser.add_argument("--peer-actions", type=int, default=10, help="fills and clears each peer does, spread over the run")
+    parser.add_argument("--size", type=int, default=800, help="canvas width and height")
+    parser.add_argument("--snapshot-every", type=int, default=200, help="operations between server snapshots")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for the session to settle")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load_test(args))
+    print(f"{results['operations']} operations from {args.streamers} streamers and {args.peers} peers "
+          f"in {results['seconds']} s ({results['operations_per_second']}/s)", file=sys.stderr)
+    print(f"round trip       p50 {results['round_trip']['p50_ms']:8.3f} ms   "
+          f"p95 {results['round_trip']['p95_ms']:8.3f} ms   p99 {results['round_trip']['p99_ms']:8.3f} ms",
+          file=sys.stderr)
+    print(f"wire size        {results['bytes_per_operation']} bytes per operation "
+          f"({results['json_bytes_per_operation']} as JSON)", file=sys.stderr)
+    print(f"late join        {results['late_join_seconds']} s to catch up on "
+          f"{results['late_join_operations']} operations", file=sys.stderr)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if not results["consistent"]:
+        print("DIVERGED: not every peer holds the drawing the server's order gives", file=sys.stderr)
+        sys.exit(1)
+    print("All peers consistent", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
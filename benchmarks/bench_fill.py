@@ -0,0 +1,69 @@
+"""Time the Fill Shape flood fill against Pillow's ImageDraw.floodfill.
+
+Two scenes are filled from the same seed with both implementations:
+
+* open  - an empty canvas, so the fill covers every pixel
+* maze  - a serpentine maze of 1 px walls, so the fill has to crawl through
+          hundreds of narrow corridors
+
+    python benchmarks/bench_fill.py --size 800 --repeat 3
+"""
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doodle_fill import flood_fill  # noqa: E402
+
+FILL = (255, 85, 85, 255)
+
+
+def open_scene(size):
+    return Image.new("RGBA", (size, size), (255, 255, 255, 255))
+
+
+def maze_scene(size, corridor=4):
+    """Horizontal walls with a gap alternating between the right and left end"""
+    image = open_scene(size)
+    draw = ImageDraw.Draw(image)
+    for i, y in enumerate(range(corridor, size, corridor)):
+        if i % 2 == 0:
+            draw.line([0, y, size - corridor - 1, y], fill=(0, 0, 0, 255))
+        else:
+            draw.line([corridor, y, size - 1, y], fill=(0, 0, 0, 255))
+    return image
+
+
+def best_time(fill, scene, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        image = scene.copy()
+        start = time.perf_counter()
+        fill(image)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        result = image
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, scene in (("open", open_scene(args.size)), ("maze", maze_scene(args.size))):
+        pillow, expected = best_time(lambda im: ImageDraw.floodfill(im, (1, 1), FILL, thresh=50), scene, args.repeat)
+        scanline, actual = best_time(lambda im: flood_fill(im, (1, 1), FILL, tolerance=50), scene, args.repeat)
+        same = "identical" if expected.tobytes() == actual.tobytes() else "DIFFERENT"
+        print(f"{name:<5} ImageDraw.floodfill {pillow * 1000:9.1f} ms   "
+              f"scanline {scanline * 1000:8.1f} ms   x{pillow / scanline:6.1f}   result {same}")
+
+
+if __name__ == "__main__":
+    main()
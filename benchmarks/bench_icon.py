@@ -0,0 +1,60 @@
+"""Time building the full icon size set from a shared downsample pyramid
+against resizing every size straight from the full-resolution drawing.
+
+    python benchmarks/bench_icon.py --size 800 --repeat 5
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doodle_export import ICON_SIZES, export_icon, icon_images  # noqa: E402
+
+
+def sample_drawing(size):
+    image = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size, max(1, size // 40)):
+        draw.line([0, i, size - i, size], fill=(255, 85, 85, 255), width=max(2, size // 80))
+        draw.ellipse([i // 2, i // 3, i // 2 + size // 5, i // 3 + size // 5], outline=(85, 85, 255, 255), width=3)
+    return image
+
+
+def naive_icon_images(image, sizes=ICON_SIZES):
+    return [image.resize((size, size), Image.LANCZOS) for size in sorted(sizes, reverse=True)]
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=800)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    image = sample_drawing(args.size)
+    naive = best_time(lambda: naive_icon_images(image), args.repeat)
+    pyramid = best_time(lambda: icon_images(image), args.repeat)
+    encode = best_time(lambda: export_icon(image, io.BytesIO()), args.repeat)
+
+    print(f"sizes {', '.join(map(str, ICON_SIZES))} from a {args.size}x{args.size} drawing")
+    print(f"naive per-size LANCZOS  {naive * 1000:8.1f} ms")
+    print(f"shared pyramid          {pyramid * 1000:8.1f} ms   x{naive / pyramid:5.1f}")
+    print(f"full .ico export        {encode * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Measure the per-motion-event redraw cost of the Doodle canvas.
+
+Replays the same synthetic stroke twice: once repainting the whole canvas
+after every segment through ``update_canvas`` and once
+pushing only the touched region through ``refresh_region``.
+
+Needs a display (run under ``xvfb-run`` on a headless machine):
+
+    python benchmarks/bench_redraw.py --size extra_large --segments 300
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doodle import DoodleApp  # noqa: E402
+
+
+class FakeEvent:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def stroke_points(segments, width, height):
+    """A looping spiral that covers most of the canvas"""
+    cx, cy = width // 2, height // 2
+    points = []
+    for i in range(segments + 1):
+        t = i / segments
+        radius = 20 + t * (min(width, height) // 2 - 40)
+        angle = t * 12 * math.pi
+        points.append((int(cx + radius * math.cos(angle)), int(cy + radius * math.sin(angle))))
+    return points
+
+
+def run(app, root, points, full):
+    timings = []
+    app.start_draw(FakeEvent(*points[0]))
+    for x, y in points[1:]:
+        start = time.perf_counter()
+        if full:
+            app.engine.extend_stroke([x, y])
+            app.old_x, app.old_y = x, y
+            app.update_canvas()
+        else:
+            # One motion event per frame: queue the point and flush it straight away
+            app.pending_points.append((x, y))
+            app.flush_stroke()
+        root.update_idletasks()
+        timings.append(time.perf_counter() - start)
+    app.end_draw(FakeEvent(*points[-1]))
+    return timings
+
+
+def report(label, timings):
+    ms = sorted(t * 1000 for t in timings)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"{label:<8} mean {statistics.mean(ms):7.3f} ms   median {statistics.median(ms):7.3f} ms   "
+          f"p95 {p95:7.3f} ms   max {ms[-1]:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=200)
+    parser.add_argument("--size", choices=["small", "medium", "large", "extra_large"], default="large")
+    args = parser.parse_args()
+
+    # Autosave into a directory of its own, so the spiral is never offered for restoring
+    with tempfile.TemporaryDirectory() as autosave:
+        root = tk.Tk()
+        app = DoodleApp(root, autosave_directory=autosave)
+        app.size_var.set(args.size)
+        app.update_brush_size()
+        root.update()
+
+        points = stroke_points(args.segments, app.canvas_width, app.canvas_height)
+        report("full", run(app, root, points, full=True))
+        report("region", run(app, root, points, full=False))
+        app.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Benchmark and regression suite for Doodle's drawing hot paths.
+
+Builds a synthetic recording (random-walk brush and eraser strokes, fills
+and background changes) from a fixed seed, then drives the headless engine
+through it and times every scenario:
+
+* brush, eraser  - one motion event: extend the stroke by a frame's worth of
+                   points and render the changed region at the current zoom
+                   (what refresh_region does before handing it to Tk)
+* stroke_commit  - end_stroke: pruning and recording the stroke for undo
+* fill_shape     - Fill Shape at random points, including the region render
+* background     - setting the background color and rendering the whole view
+* undo, redo     - stepping back through the whole history and forward again
+* replay         - replaying the recording on a fresh engine, as one timing
+* export_<fmt>   - writing every export format to a temporary directory
+
+Tk is never imported, so it runs anywhere the engine does; the Tk blit
+itself is covered by bench_redraw.py under xvfb-run.  Results are printed
+as JSON: latency percentiles in milliseconds, throughput, undo memory per
+action and peak RSS.  Given a baseline (a previous --output), it exits with
+status 1 when a scenario got slower, or used more memory, by more than the
+threshold.  Latencies are first scaled by how long a fixed calibration
+workload took in each run, so a slower or busier machine does not count as
+a regression:
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json --threshold 0.25
+    python benchmarks/bench_suite.py --write-baseline benchmarks/baseline.json
+
+The committed baseline.json was taken on one machine; regenerate it with
+--write-baseline on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from doodle_engine import DoodleEngine  # noqa: E402
+from doodle_export import FORMATS  # noqa: E402
+from doodle_viewport import Viewport  # noqa: E402
+
+COLORS = ["#FF5555", "#55FF55", "#5555FF", "#FFFF55", "#FF55FF", "#55FFFF", "#000000", "#FFFFFF"]
+SIZES = [2, 5, 10, 20]  # The app's small, medium, large and extra large brushes
+LATENCY_METRICS = ("p50_ms", "p95_ms")  # Compared against the baseline
+TAIL_SAMPLES = 20  # Fewer timings than this and p95 is just the slowest one, so it is not compared
+MEMORY_METRICS = ("bytes_per_action",)
+
+
+def synthetic_recording(seed, strokes, width, height, points_per_stroke=120):
+    """Engine operations for a drawing session: mostly brush strokes, some erasing, fills and backgrounds"""
+    rng = random.Random(seed)
+    operations = []
+    for i in range(strokes):
+        x, y = rng.randrange(width), rng.randrange(height)
+        heading_x, heading_y = rng.uniform(-6, 6), rng.uniform(-6, 6)
+        points = [x, y]
+        for _ in range(points_per_stroke):
+            # A smooth random walk, like a hand moving at a steady pace
+            heading_x = max(-8, min(8, heading_x + rng.uniform(-2, 2)))
+            heading_y = max(-8, min(8, heading_y + rng.uniform(-2, 2)))
+            x = max(0, min(width - 1, round(x + heading_x)))
+            y = max(0, min(height - 1, round(y + heading_y)))
+            points.extend((x, y))
+        operations.append({"op": "stroke", "tool": "eraser" if i % 5 == 4 else "brush",
+                           "color": rng.choice(COLORS), "size": rng.choice(SIZES), "points": points})
+        if i % 5 == 4:
+            operations.append({"op": "fill_shape", "color": rng.choice(COLORS), "x": rng.randrange(width),
+                               "y": rng.randrange(height), "tolerance": 50})
+        if i % 10 == 9:
+            operations.append({"op": "fill_background", "color": rng.choice(COLORS)})
+    return operations
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(timings, **extra):
+    ms = sorted(t * 1000 for t in timings)
+    total = sum(timings)
+    result = {
+        "count": len(ms),
+        "mean_ms": round(total * 1000 / len(ms), 4),
+        "p50_ms": round(percentile(ms, 0.50), 4),
+        "p90_ms": round(percentile(ms, 0.90), 4),
+        "p95_ms": round(percentile(ms, 0.95), 4),
+        "p99_ms": round(percentile(ms, 0.99), 4),
+        "max_ms": round(ms[-1], 4),
+        "per_second": round(len(ms) / total, 1) if total else None,
+    }
+    result.update(extra)
+    return result
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KiB (None where it cannot be read)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes, Linux KiB
+
+
+def calibrate():
+    """Time a fixed mix of Python and Pillow work, to tell a slower machine from slower code"""
+    start = time.perf_counter()
+    image = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+    layer = Image.new("RGBA", (512, 512), (255, 85, 85, 128))
+    for i in range(10):
+        ImageDraw.Draw(image).line([0, i * 50, 511, 511 - i * 50], fill=(85, 85, 255, 255), width=9)
+        image = Image.alpha_composite(image, layer)
+    sorted(random.Random(1).random() for _ in range(30000))
+    return round((time.perf_counter() - start) * 1000, 4)
+
+
+def render_region(engine, viewport, box):
+    view_box = viewport.to_view_box(box)
+    if view_box is not None:
+        viewport.render(engine.composite, view_box, engine.background)
+
+
+def run_drawing(engine, viewport, operations, frame_points):
+    """Play the recording through the engine the way the app does; returns timings per scenario"""
+    timings = {"brush": [], "eraser": [], "stroke_commit": [], "fill_shape": [], "background": []}
+    for operation in operations:
+        kind = operation["op"]
+        if kind == "stroke":
+            engine.mode = operation["tool"]
+            engine.current_color = operation["color"]
+            engine.brush_size = operation["size"]
+            points = operation["points"]
+            render_region(engine, viewport, engine.begin_stroke(points[0], points[1]))
+            for i in range(2, len(points), 2 * frame_points):
+                start = time.perf_counter()
+                render_region(engine, viewport, engine.extend_stroke(points[i:i + 2 * frame_points]))
+                timings[operation["tool"]].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.end_stroke()
+            timings["stroke_commit"].append(time.perf_counter() - start)
+        elif kind == "fill_shape":
+            engine.current_color = operation["color"]
+            start = time.perf_counter()
+            render_region(engine, viewport, engine.fill_shape(operation["x"], operation["y"]))
+            timings["fill_shape"].append(time.perf_counter() - start)
+        elif kind == "fill_background":
+            engine.current_color = operation["color"]
+            start = time.perf_counter()
+            engine.fill_background()
+            viewport.render(engine.composite, background=engine.background)
+            timings["background"].append(time.perf_counter() - start)
+    return timings
+
+
+def run_history(engine, viewport):
+    timings = {"undo": [], "redo": []}
+    for name, step, available in (("undo", engine.undo, engine.history.can_undo),
+                                  ("redo", engine.redo, engine.history.can_redo)):
+        while available():
+            start = time.perf_counter()
+            render_region(engine, viewport, step())
+            timings[name].append(time.perf_counter() - start)
+    return timings
+
+
+def run_exports(engine, repeat):
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for format_type, (extension, _) in FORMATS.items():
+            path = os.path.join(directory, "drawing" + extension)
+            timings["export_" + format_type] = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                engine.export(path, format_type)
+                timings["export_" + format_type].append(time.perf_counter() - start)
+    return timings
+
+
+def run_suite(args):
+    operations = synthetic_recording(args.seed, args.strokes, args.size, args.size)
+    engine = DoodleEngine(args.size, args.size)
+    viewport = Viewport(args.size, args.size)
+    results = {}
+
+    engine.start_recording()
+    for name, timings in run_drawing(engine, viewport, operations, args.frame_points).items():
+        if timings:
+            results[name] = summarize(timings)
+    recorded = engine.stop_recording()
+    history = engine.history
+    # Undo memory is what save_state used to cost per action
+    results["stroke_commit"]["bytes_per_action"] = round(history.nbytes / max(1, len(history.undo_stack)))
+
+    for name, timings in run_exports(engine, args.repeat).items():
+        results[name] = summarize(timings)
+
+    for name, timings in run_history(engine, viewport).items():
+        results[name] = summarize(timings)
+
+    replayed = DoodleEngine(args.size, args.size)
+    start = time.perf_counter()
+    replayed.replay(recorded)
+    elapsed = time.perf_counter() - start
+    # One timing for the whole recording; its p50 is the total
+    results["replay"] = summarize([elapsed], operations=len(recorded),
+                                  operations_per_second=round(len(recorded) / elapsed, 1))
+
+    return {
+        "calibration_ms": calibrate(),
+        "config": {"seed": args.seed, "strokes": args.strokes, "size": args.size,
+                   "frame_points": args.frame_points, "repeat": args.repeat},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "peak_rss_kb": peak_rss_kb(),
+        "scenarios": results,
+    }
+
+
+def median_of(runs):
+    """Combine several suite runs, keeping the median of every metric to shed scheduler noise"""
+    combined = dict(runs[0], runs=len(runs))
+    combined["scenarios"] = {
+        name: {metric: statistics.median(run["scenarios"][name][metric] for run in runs)
+               if isinstance(value, (int, float)) and metric != "count" else value
+               for metric, value in scenario.items()}
+        for name, scenario in runs[0]["scenarios"].items()
+    }
+    combined["peak_rss_kb"] = runs[-1]["peak_rss_kb"]  # Peak over the whole process
+    combined["calibration_ms"] = statistics.median(run["calibration_ms"] for run in runs)
+    return combined
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Regressions of results against baseline, as readable strings"""
+    if baseline["config"] != results["config"]:
+        return [f"baseline was taken with different settings: {baseline['config']}"]
+    # Latencies are compared as if the baseline had run on this machine at its current speed
+    speed = results["calibration_ms"] / baseline["calibration_ms"]
+    regressions = []
+    for name, current in results["scenarios"].items():
+        reference = baseline["scenarios"].get(name)
+        if reference is None:
+            continue
+        for metric in LATENCY_METRICS + MEMORY_METRICS:
+            if current.get(metric) is None or reference.get(metric) is None:
+                continue
+            if metric == "p95_ms" and current["count"] < TAIL_SAMPLES:
+                continue
+            expected = reference[metric]
+            limit = expected * (1 + threshold)
+            if metric in LATENCY_METRICS:
+                expected = round(expected * speed, 4)
+                # Timer noise on sub-millisecond scenarios is not a regression
+                limit = max(expected * (1 + threshold), expected + min_delta_ms)
+            if current[metric] > limit:
+                regressions.append(f"{name} {metric}: {current[metric]} > {expected} (+{threshold:.0%})")
+    if baseline.get("peak_rss_kb") and results.get("peak_rss_kb"):
+        if results["peak_rss_kb"] > baseline["peak_rss_kb"] * (1 + threshold):
+            regressions.append(f"peak_rss_kb: {results['peak_rss_kb']} > {baseline['peak_rss_kb']} (+{threshold:.0%})")
+    return regressions
+
+
+def report(results):
+    """Human-readable table on stderr, so stdout stays valid JSON"""
+    for name, result in results["scenarios"].items():
+        print(f"{name:<16} n {result['count']:5d}   p50 {result['p50_ms']:8.3f} ms   p95 {result['p95_ms']:8.3f} ms   "
+              f"p99 {result['p99_ms']:8.3f} ms   {result['per_second']:10.1f}/s", file=sys.stderr)
+    print(f"replay           {results['scenarios']['replay']['operations_per_second']} operations/s", file=sys.stderr)
+    print(f"undo memory      {results['scenarios']['stroke_commit']['bytes_per_action']} bytes per action",
+          file=sys.stderr)
+    print(f"peak RSS         {results['peak_rss_kb']} KiB", file=sys.stderr)
+    print(f"calibration      {results['calibration_ms']} ms", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--strokes", type=int, default=100)
+    parser.add_argument("--size", type=int, default=800, help="canvas width and height")
+    parser.add_argument("--frame-points", type=int, default=3, help="motion points coalesced into one frame")
+    parser.add_argument("--repeat", type=int, default=3, help="times each export format is written")
+    parser.add_argument("--runs", type=int, default=3, help="whole-suite runs; the median of each metric is kept")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="latency increases smaller than this never count as regressions")
+    parser.add_argument("--write-baseline", metavar="PATH", help="save the results as the new baseline")
+    args = parser.parse_args()
+
+    results = median_of([run_suite(args) for _ in range(args.runs)])
+    report(results)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,60 @@
+import time
+
+STARTED = time.perf_counter()  # Before the imports below, so --profile-startup can time them
+
 import tkinter as tk
-from tkinter import ttk, colorchooser, filedialog, messagebox, PhotoImage
-from PIL import Image, ImageTk, ImageDraw, ImageColor
+from tkinter import ttk
+from PIL import Image, ImageTk, ImageColor
+import importlib.util
 import os
-import copy
 import sys
 
+from doodle_engine import DoodleEngine
+from doodle_journal import Journal
+from doodle_trace import StartupProfile, default_trace_path, traced, tracer
+from doodle_viewport import Viewport
+
+# Time from launch to the first painted window that --profile-startup checks against
+STARTUP_BUDGET = 0.4  # seconds
+
+
+def lazy_import(name):
+    """Return module name, loaded on first attribute access rather than now"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        # Only referenced by name here, so a frozen build needs it in doodle.spec's hiddenimports
+        raise ImportError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Only needed once a dialog opens or a file is saved, imported or opened, so kept off the startup path.
+# Keep this list in step with hiddenimports in doodle.spec.
+filedialog = lazy_import("tkinter.filedialog")
+messagebox = lazy_import("tkinter.messagebox")
+doodle_collab = lazy_import("doodle_collab")
+doodle_export = lazy_import("doodle_export")
+doodle_import = lazy_import("doodle_import")
+doodle_project = lazy_import("doodle_project")
+
 
 class DoodleApp:
-    def __init__(self, root):
+    def __init__(self, root, profile=None, join=None, autosave_directory=None, drawing_size=(800, 800)):
         self.root = root
         self.root.title("Doodle")
-
-        # Change the icon path from .png to .ico
-        icon_path = "doodle_icon.ico"  # Default for script execution
-        if getattr(sys, 'frozen', False):  # Running as an .exe
-            icon_path = os.path.join(sys._MEIPASS, "doodle_icon.ico")
-
-        try:
-            self.root.iconbitmap(icon_path)  # Use iconbitmap instead of iconphoto for .ico files
-        except Exception as e:
-            print("Icon loading failed:", e)
+        self.profile = profile  # StartupProfile to time the startup phases in, if any
 
         self.root.configure(bg="#333333")
         
         # Set initial window size and position
         screen_width = root.winfo_screenwidth()
         screen_height = root.winfo_screenheight()
-        window_width = 1000
+        window_width = 1200
         window_height = 900
         x_position = (screen_width - window_width) // 2
         y_position = (screen_height - window_height) // 2
@@ -44,35 +72,127 @@ class DoodleApp:
                             font=('Courier', 10, 'bold'))
         self.style.configure('TFrame', background='#333333')
             
-        # Canvas dimensions
-        self.canvas_width = 800
-        self.canvas_height = 800
-            
+        # Drawing dimensions, and the canvas widget's, which shows up to 800x800 of it at a time
+        self.drawing_width, self.drawing_height = drawing_size
+        self.canvas_width = min(self.drawing_width, 800)
+        self.canvas_height = min(self.drawing_height, 800)
+
+        # Transparency checkerboard: square size and the two alternating colors
+        self.checker_size = 20
+        self.checker_colors = ("#EEEEEE", "#DDDDDD")
+
         # Variables
-        self.current_color = "#000000"  # Default: Black
-        self.brush_size = 5  # Default: Medium
-        self.mode = "brush"  # Default: Brush mode
         self.old_x = None
         self.old_y = None
         self.selected_color_button = None  # Track the currently selected color button
+
+        # Persistent canvas items, created on the first update_canvas and reused afterwards
+        self.tk_image = None
+        self.image_item = None
+        self.checker_image = None
+        self.checker_item = None
+        self.checker_key = None  # (width, height, square size, colors) the checkerboard was built for
             
-        # Initialize the PIL image with transparency
-        self.pil_image = Image.new("RGBA", (self.canvas_width, self.canvas_height), (255, 255, 255, 0))
-        self.pil_draw = ImageDraw.Draw(self.pil_image)
-            
-        # Undo/Redo stacks
-        self.history_stack = []
-        self.redo_stack = []
+        # The drawing engine owns the image, the tool state and the undo/redo history
+        self.history_budget = 32 * 1024 * 1024  # bytes
+        self.engine = DoodleEngine(self.drawing_width, self.drawing_height, history_budget=self.history_budget)
+
+        # Zoom and pan: maps widget coordinates to drawing coordinates and renders the visible part
+        self.viewport = Viewport(self.canvas_width, self.canvas_height)
+        self.pan_start = None
+
+        # Render scheduling: motion points are queued and drawn as one polyline per frame
+        self.frame_rate = 60  # Target repaints per second while drawing
+        self.pending_points = []  # Points received since the last frame
+        self.frame_job = None  # Pending root.after id for the next frame
+        self.last_frame_time = 0.0
+
+        # Saves run on worker threads; poll_exports reports on them from the Tk event loop.
+        # The exporter and importer are made on first use.
+        self.exporter = None
+        self.export_poll_job = None
+
+        # Imports are decoded on a worker thread, then pasted in a band of rows per frame
+        self.importer = None
+        self.import_future = None  # Decode in progress: (future, path)
+        self.import_state = None  # Paste in progress: (image, position, path, next row)
+        self.import_job = None
+
+        # The .doodle file the drawing was opened from or last saved to, if any
+        self.project = None
+        self.startup_job = None  # Pending finish_startup call
+
+        # Shared session (see doodle_collab): joined once startup has finished, if an address was given
+        self.join_address = join
+        self.session = None
+        self.session_thread = None
+        self.session_job = None
+        self.session_snapshots = 0  # Snapshots of the shared drawing loaded so far
+        self.mark_startup("app state")
             
         # Create the interface
         self.create_widgets()
+        self.mark_startup("widgets")
+            
+        # Autosave: every committed operation goes to an on-disk journal, written off the Tk thread.
+        # Checking for and restoring a previous session waits until the window is up (finish_startup).
+        # autosave_directory replaces ~/.doodle/autosave, e.g. for a benchmark that must not touch it.
+        self.journal = Journal(autosave_directory)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
             
-        # Save initial empty state
-        self.save_state()
+        # Nothing to undo yet
+        self.update_undo_redo_status()
             
         # Bind keyboard shortcuts
+        self.root.bind("<Control-s>", lambda e: self.save_project())
+        self.root.bind("<Control-o>", lambda e: self.load_project())
         self.root.bind("<Control-z>", lambda e: self.undo())
         self.root.bind("<Control-y>", lambda e: self.redo())
+        self.root.bind("<Control-plus>", lambda e: self.zoom_view(1.25))
+        self.root.bind("<Control-equal>", lambda e: self.zoom_view(1.25))
+        self.root.bind("<Control-minus>", lambda e: self.zoom_view(0.8))
+        self.root.bind("<Control-0>", lambda e: self.reset_view())
+        self.root.bind("<F12>", lambda e: self.toggle_tracing())
+        
+        # Performance tracing, off unless DOODLE_TRACE is set or F12 is pressed
+        self.perf_job = None
+        if os.environ.get("DOODLE_TRACE"):
+            self.toggle_tracing()
+
+        # Show the window now, and do what its first frame does not need once it is on screen
+        self.root.update()
+        self.mark_startup("first paint")
+        self.startup_job = self.root.after_idle(self.finish_startup)
+
+    def mark_startup(self, phase):
+        if self.profile is not None:
+            self.profile.mark(phase)
+
+    def finish_startup(self):
+        """Second half of startup, run once the first frame is on screen"""
+        self.startup_job = None
+        self.build_checkerboard()
+
+        # Change the icon path from .png to .ico
+        icon_path = "doodle_icon.ico"  # Default for script execution
+        if getattr(sys, 'frozen', False):  # Running as an .exe
+            icon_path = os.path.join(sys._MEIPASS, "doodle_icon.ico")
+
+        try:
+            self.root.iconbitmap(icon_path)  # Use iconbitmap instead of iconphoto for .ico files
+        except Exception as e:
+            print("Icon loading failed:", e)
+        self.mark_startup("checkerboard and icon")
+
+        self.restore_autosave()
+        self.journal.attach(self.engine)
+        self.mark_startup("autosave")
+
+        if self.join_address:
+            self.join_session(self.join_address)
+
+        if self.profile is not None:
+            print(self.profile.report(STARTUP_BUDGET, "first paint"))
             
     def create_widgets(self):
         # Main frame
@@ -100,6 +220,9 @@ class DoodleApp:
         # Add Background Fill tool
         self.bg_fill_button = ttk.Button(tools_frame, text="FILL BACKGROUND", command=lambda: self.set_mode("bg_fill"))
         self.bg_fill_button.pack(fill=tk.X, pady=2)
+        
+        no_bg_button = ttk.Button(tools_frame, text="NO BACKGROUND", command=self.remove_background)
+        no_bg_button.pack(fill=tk.X, pady=2)
             
         # Undo/Redo buttons
         undo_redo_frame = ttk.Frame(tools_frame)
@@ -147,10 +270,53 @@ class DoodleApp:
 
         save_ico_button = ttk.Button(tools_frame, text="SAVE ICO", command=lambda: self.save_image("ico"))
         save_ico_button.pack(fill=tk.X, pady=2)
+
+        save_icon_pngs_button = ttk.Button(tools_frame, text="SAVE ICON PNGS",
+                                           command=lambda: self.save_image("icon_pngs"))
+        save_icon_pngs_button.pack(fill=tk.X, pady=2)
+
+        save_all_button = ttk.Button(tools_frame, text="SAVE ALL", command=self.save_all_formats)
+        save_all_button.pack(fill=tk.X, pady=2)
+        
+        open_project_button = ttk.Button(tools_frame, text="OPEN PROJECT", command=self.load_project)
+        open_project_button.pack(fill=tk.X, pady=(10, 2))
+        
+        save_project_button = ttk.Button(tools_frame, text="SAVE PROJECT", command=self.save_project)
+        save_project_button.pack(fill=tk.X, pady=2)
+        
+        import_button = ttk.Button(tools_frame, text="IMPORT IMAGE", command=self.import_image)
+        import_button.pack(fill=tk.X, pady=2)
         
         clear_button = ttk.Button(tools_frame, text="CLEAR ALL", command=self.clear_canvas)
         clear_button.pack(fill=tk.X, pady=(20, 2))
         
+        # Layers panel on the far right; the list shows the top layer first
+        layers_frame = ttk.Frame(main_frame)
+        layers_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=10)
+        
+        ttk.Label(layers_frame, text="LAYERS").pack(pady=(0, 10))
+        
+        self.layer_list = tk.Listbox(layers_frame, height=10, width=18, exportselection=False,
+                                     bg="#444444", fg="#DDDDDD", selectbackground="#777777",
+                                     font=('Courier', 10), highlightthickness=0, relief='flat')
+        self.layer_list.pack(fill=tk.X, pady=2)
+        self.layer_list.bind("<<ListboxSelect>>", self.select_layer)
+        
+        ttk.Button(layers_frame, text="ADD", command=self.add_layer).pack(fill=tk.X, pady=2)
+        ttk.Button(layers_frame, text="DELETE", command=self.delete_layer).pack(fill=tk.X, pady=2)
+        ttk.Button(layers_frame, text="UP", command=lambda: self.move_layer(1)).pack(fill=tk.X, pady=2)
+        ttk.Button(layers_frame, text="DOWN", command=lambda: self.move_layer(-1)).pack(fill=tk.X, pady=2)
+        ttk.Button(layers_frame, text="SHOW/HIDE", command=self.toggle_layer).pack(fill=tk.X, pady=2)
+        ttk.Button(layers_frame, text="MERGE DOWN", command=self.merge_layer_down).pack(fill=tk.X, pady=2)
+        
+        ttk.Label(layers_frame, text="OPACITY").pack(pady=(20, 10))
+        
+        # Applied when the slider is released, so a drag is one undoable change
+        self.layer_opacity = tk.DoubleVar(value=100)
+        opacity_scale = ttk.Scale(layers_frame, from_=0, to=100, variable=self.layer_opacity)
+        opacity_scale.pack(fill=tk.X, pady=2)
+        opacity_scale.bind("<ButtonRelease-1>", lambda e: self.set_layer_opacity())
+        
         # Right area for canvas and colors
         canvas_color_frame = ttk.Frame(main_frame)
         canvas_color_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -199,7 +365,7 @@ class DoodleApp:
         canvas_frame = ttk.Frame(canvas_color_frame)
         canvas_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         
-        # Create the canvas with checker pattern background to show transparency
+        # Create the canvas; the checkerboard background item is added by build_checkerboard once the window is up
         self.canvas = tk.Canvas(canvas_frame, width=self.canvas_width, height=self.canvas_height,
                             bg="white", highlightthickness=1, highlightbackground="#555555")
         self.canvas.pack(padx=10, pady=10)
@@ -209,6 +375,13 @@ class DoodleApp:
         self.canvas.bind("<B1-Motion>", self.draw)
         self.canvas.bind("<ButtonRelease-1>", self.end_draw)
         
+        # Zoom with the mouse wheel (Button-4/5 on X11), pan by dragging with the middle button
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom_view(1.25 if e.delta > 0 else 0.8, e.x, e.y))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_view(1.25, e.x, e.y))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_view(0.8, e.x, e.y))
+        self.canvas.bind("<ButtonPress-2>", self.start_pan)
+        self.canvas.bind("<B2-Motion>", self.pan_view)
+        
         # Create the initial drawable image
         self.update_canvas()
         
@@ -221,16 +394,22 @@ class DoodleApp:
                             anchor=tk.W, font=('Courier', 9))
         status_label.pack(side=tk.LEFT)
         
+        # Frame time readout while performance tracing is on (F12)
+        self.perf_text = tk.StringVar(value="")
+        perf_label = ttk.Label(status_frame, textvariable=self.perf_text, anchor=tk.W, font=('Courier', 9))
+        perf_label.pack(side=tk.LEFT, padx=(20, 0))
+        
         # Keyboard shortcuts info
-        shortcuts_label = ttk.Label(status_frame, text="Shortcuts: Ctrl+Z (Undo) | Ctrl+Y (Redo)",
+        shortcuts_label = ttk.Label(status_frame, text="Shortcuts: Ctrl+S (Save project) | Ctrl+Z (Undo) | Ctrl+Y (Redo) | Wheel (Zoom) | Middle drag (Pan) | Ctrl+0 (Reset view) | F12 (Trace)",
                                 anchor=tk.E, font=('Courier', 9))
         shortcuts_label.pack(side=tk.RIGHT)
         
         # Set initial color selection visual cue
         self.set_color("#000000", self.color_buttons["#000000"])
+        self.update_layer_list()
     
     def set_mode(self, mode):
-        self.mode = mode
+        self.engine.mode = mode
         
         # Reset all buttons
         self.brush_button.state(['!pressed'])
@@ -255,18 +434,18 @@ class DoodleApp:
     def update_brush_size(self):
         size_value = self.size_var.get()
         if size_value == "small":
-            self.brush_size = 2
+            self.engine.brush_size = 2
         elif size_value == "medium":
-            self.brush_size = 5
+            self.engine.brush_size = 5
         elif size_value == "large":
-            self.brush_size = 10
+            self.engine.brush_size = 10
         else:  # extra_large
-            self.brush_size = 20
+            self.engine.brush_size = 20
         
-        self.status_text.set(f"{self.mode.capitalize().replace('_', ' ')} mode - {size_value.replace('_', ' ')} size")
+        self.status_text.set(f"{self.engine.mode.capitalize().replace('_', ' ')} mode - {size_value.replace('_', ' ')} size")
     
     def set_color(self, color, button=None):
-        self.current_color = color
+        self.engine.current_color = color
         self.status_text.set(f"Selected color: {color}")
         
         # Reset border of previously selected button
@@ -283,16 +462,18 @@ class DoodleApp:
             self.selected_color_button = button
         
         # Switch to brush mode when selecting a color
-        if self.mode not in ["fill_shape", "bg_fill"]:
+        if self.engine.mode not in ["fill_shape", "bg_fill"]:
             self.set_mode("brush")
     
+    @traced
     def start_draw(self, event):
-        x, y = event.x, event.y
+        self.finish_import()
+        x, y = self.viewport.to_image(event.x, event.y)
         
-        if self.mode == "fill_shape":
+        if self.engine.mode == "fill_shape":
             self.flood_fill_shape(x, y)
             return
-        elif self.mode == "bg_fill":
+        elif self.engine.mode == "bg_fill":
             self.fill_background()
             return
         
@@ -301,221 +482,611 @@ class DoodleApp:
         # Draw a dot at the starting point
         self.draw_point(x, y)
     
+    @traced
     def draw(self, event):
-        if self.old_x and self.old_y and self.mode in ["brush", "eraser"]:
-            if self.mode == "brush":
-                self.pil_draw.line([self.old_x, self.old_y, event.x, event.y],
-                                fill=self.current_color, width=self.brush_size)
-            else:  # eraser
-                # For the eraser, we use (0, 0, 0, 0) which is fully transparent
-                self.pil_draw.line([self.old_x, self.old_y, event.x, event.y],
-                                fill=(0, 0, 0, 0), width=self.brush_size)
-            
-            self.old_x = event.x
-            self.old_y = event.y
-            self.update_canvas()
+        if self.old_x and self.old_y and self.engine.mode in ["brush", "eraser"]:
+            # Queue the point; it is rasterised with the rest of this frame's points
+            self.pending_points.append(self.viewport.to_image(event.x, event.y))
+            if self.frame_job is None:
+                # Wait until a full frame interval has passed since the last repaint
+                interval = 1.0 / self.frame_rate
+                delay = max(0.0, self.last_frame_time + interval - time.perf_counter())
+                self.frame_job = self.root.after(int(delay * 1000), self.flush_stroke)
+    
+    @traced
+    def flush_stroke(self):
+        """Draw every queued motion point as one polyline and repaint the area once"""
+        self.frame_job = None
+        if not self.pending_points or self.old_x is None:
+            self.pending_points.clear()
+            return
+        
+        points = []
+        for x, y in self.pending_points:
+            points.extend((x, y))
+        self.pending_points.clear()
+        
+        box = self.engine.extend_stroke(points)
+        self.old_x = points[-2]
+        self.old_y = points[-1]
+        self.refresh_region(box)
+        self.last_frame_time = time.perf_counter()
     
+    @traced
     def end_draw(self, event):
-        if self.mode in ["brush", "eraser"]:
+        if self.engine.mode in ["brush", "eraser"]:
+            # Draw whatever is still queued before the stroke is recorded
+            if self.frame_job is not None:
+                self.root.after_cancel(self.frame_job)
+            self.flush_stroke()
             self.reset_coordinates(event)
-            # Save state for undo/redo after drawing
-            self.save_state()
+            # Save state for undo/redo after drawing, only comparing the area the stroke touched
+            self.engine.end_stroke()
+            self.update_undo_redo_status()
     
     def draw_point(self, x, y):
-        if self.mode == "brush":
-            self.pil_draw.ellipse([x-self.brush_size//2, y-self.brush_size//2,
-                                x+self.brush_size//2, y+self.brush_size//2],
-                                fill=self.current_color, outline=self.current_color)
-        else:  # eraser
-            self.pil_draw.ellipse([x-self.brush_size//2, y-self.brush_size//2,
-                                x+self.brush_size//2, y+self.brush_size//2],
-                                fill=(0, 0, 0, 0), outline=(0, 0, 0, 0))
-        self.update_canvas()
+        self.refresh_region(self.engine.begin_stroke(x, y))
     
     def reset_coordinates(self, event):
         self.old_x = None
         self.old_y = None
     
+    @traced
     def fill_background(self):
         """Fill the entire background with the selected color"""
-        # Create a new layer with the selected color
-        bg_layer = Image.new("RGBA", self.pil_image.size, self.current_color)
-        
-        # Paste the current image on top of the background
-        # Use the alpha channel of the current image as a mask
-        result = Image.alpha_composite(bg_layer, self.pil_image)
-        
-        # Update the drawing area
-        self.pil_image = result
-        self.pil_draw = ImageDraw.Draw(self.pil_image)
+        # The background is a property of the drawing, composed under it only for display and export
+        self.engine.fill_background()
         
         # Update display
         self.update_canvas()
-        self.save_state()
-        self.status_text.set(f"Background filled with color: {self.current_color}")
+        self.update_undo_redo_status()
+        self.status_text.set(f"Background filled with color: {self.engine.current_color}")
+    
+    def remove_background(self):
+        """Make the background transparent again"""
+        if self.engine.set_background(None) is None:
+            self.status_text.set("The background is already transparent")
+            return
+        self.update_canvas()
+        self.update_undo_redo_status()
+        self.status_text.set("Background removed")
     
+    @traced
     def flood_fill_shape(self, x, y):
         """Fill a shape containing the point (x,y) with the selected color"""
         try:
-            # Get RGBA values for the fill color
-            rgba = ImageColor.getrgb(self.current_color)
-            if len(rgba) == 3:  # Convert RGB to RGBA
-                rgba = rgba + (255,)  # Add full alpha
-            
-            # Create a copy of the image for fill operation
-            img_copy = self.pil_image.copy()
-            ImageDraw.floodfill(img_copy, (x, y), rgba, thresh=50)
-            
-            # Update the image
-            self.pil_image = img_copy
-            self.pil_draw = ImageDraw.Draw(self.pil_image)
+            # Fill in place; only the filled box needs repainting and recording
+            box = self.engine.fill_shape(x, y)
+            if box is None:
+                self.status_text.set("Nothing to fill here")
+                return
             
             # Update display
-            self.update_canvas()
-            self.save_state()
-            self.status_text.set(f"Shape filled with color: {self.current_color}")
+            self.refresh_region(box)
+            self.update_undo_redo_status()
+            self.status_text.set(f"Shape filled with color: {self.engine.current_color}")
         except Exception as e:
             self.status_text.set(f"Fill failed: {str(e)}")
             print("Fill error:", e)
     
+    @traced(category="frame")
     def update_canvas(self):
-        # Convert PIL image for display
-        self.tk_image = ImageTk.PhotoImage(self.pil_image)
-        
-        # Clear the canvas and display the new image
-        self.canvas.delete("all")
-        
-        # Create a checkerboard pattern to indicate transparency
-        for i in range(0, self.canvas_width, 20):
-            for j in range(0, self.canvas_height, 20):
-                if (i // 20 + j // 20) % 2 == 0:
-                    self.canvas.create_rectangle(i, j, i+20, j+20, fill="#EEEEEE", outline="")
+        # Compose the visible part of the drawing at the displayed scale
+        with tracer.span("render"):
+            image = self.viewport.render(self.engine.composite, background=self.engine.background)
+
+        if self.tk_image is None or (self.tk_image.width(), self.tk_image.height()) != image.size:
+            # First draw or resized canvas: make a new photo and point the existing item at it
+            with tracer.span("photoimage"):
+                self.tk_image = ImageTk.PhotoImage(image)
+            with tracer.span("tk_item"):
+                if self.image_item is None:
+                    self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image,
+                                                               tags="drawing")
                 else:
-                    self.canvas.create_rectangle(i, j, i+20, j+20, fill="#DDDDDD", outline="")
-        
-        # Display the image on top of the checkerboard
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
+                    self.canvas.itemconfigure(self.image_item, image=self.tk_image)
+        else:
+            # Same size: overwrite the pixels of the photo already on the canvas
+            with tracer.span("photoimage"):
+                self.tk_image.paste(image)
+
+    def zoom_view(self, factor, x=None, y=None):
+        """Zoom by factor around view position (x, y), the centre of the view by default"""
+        if x is None:
+            x, y = self.canvas_width / 2, self.canvas_height / 2
+        self.viewport.zoom_at(factor, x, y)
+        self.update_canvas()
+        self.status_text.set(f"Zoom {self.viewport.zoom * 100:.0f}%")
     
-    def save_state(self):
-        """Save current state to history stack for undo functionality"""
-        # Create a deep copy of the current image
-        state_copy = self.pil_image.copy()
-        self.history_stack.append(state_copy)
-        
-        # Clear redo stack when new action is performed
-        self.redo_stack.clear()
-        
-        # Limit history size to prevent excessive memory usage
-        if len(self.history_stack) > 20:
-            self.history_stack.pop(0)
-        
-        self.update_undo_redo_status()
+    def start_pan(self, event):
+        self.pan_start = (event.x, event.y)
+    
+    def pan_view(self, event):
+        if self.pan_start is None:
+            return
+        self.viewport.pan(event.x - self.pan_start[0], event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.update_canvas()
     
+    def reset_view(self):
+        self.viewport.reset()
+        self.update_canvas()
+        self.status_text.set("Zoom 100%")
+    
+    def build_checkerboard(self):
+        """Render the transparency checkerboard into one background image item, if it is out of date"""
+        key = (self.canvas_width, self.canvas_height, self.checker_size, self.checker_colors)
+        if key == self.checker_key:
+            return
+
+        # One pixel per square, then blow it up with nearest-neighbour scaling
+        square = self.checker_size
+        cols = -(-self.canvas_width // square)
+        rows = -(-self.canvas_height // square)
+        light = ImageColor.getrgb(self.checker_colors[0])
+        dark = ImageColor.getrgb(self.checker_colors[1])
+        pattern = Image.new("RGB", (cols, rows))
+        pattern.putdata([light if (i + j) % 2 == 0 else dark for j in range(rows) for i in range(cols)])
+        pattern = pattern.resize((cols * square, rows * square), Image.NEAREST)
+        pattern = pattern.crop((0, 0, self.canvas_width, self.canvas_height))
+
+        self.checker_image = ImageTk.PhotoImage(pattern)
+        if self.checker_item is None:
+            self.checker_item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.checker_image,
+                                                         tags="checker")
+            self.canvas.tag_lower("checker")
+        else:
+            self.canvas.itemconfigure(self.checker_item, image=self.checker_image)
+        self.checker_key = key
+
+    @traced(category="frame")
+    def refresh_region(self, box):
+        """Push only the given drawing box into the displayed PhotoImage"""
+        view_box = self.viewport.to_view_box(box)
+        if view_box is None:
+            return
+
+        # Render just the touched patch at the current zoom, then let Tk blit it into the persistent photo.
+        # The "set" rule replaces pixels instead of blending, so erased areas become transparent again.
+        with tracer.span("render"):
+            image = self.viewport.render(self.engine.composite, view_box, self.engine.background)
+        with tracer.span("photoimage"):
+            patch = ImageTk.PhotoImage(image)
+        with tracer.span("tk_copy"):
+            self.canvas.tk.call(str(self.tk_image), "copy", str(patch),
+                                "-to", view_box[0], view_box[1], "-compositingrule", "set")
+    
+    @traced
     def undo(self):
         """Undo the last drawing action"""
-        if len(self.history_stack) > 1:  # Need at least 2 states to undo (current and previous)
-            # Move current state to redo stack
-            current_state = self.history_stack.pop()
-            self.redo_stack.append(current_state)
-            
-            # Restore previous state
-            previous_state = self.history_stack[-1]
-            self.pil_image = previous_state.copy()
-            self.pil_draw = ImageDraw.Draw(self.pil_image)
-            
-            self.update_canvas()
+        if self.session_blocks("Undo"):
+            return
+        self.finish_import()
+        # Patch the previous pixels back in place and repaint only that area
+        if self.engine.history.can_undo():
+            self.refresh_region(self.engine.undo())
             self.status_text.set("Undo successful")
             self.update_undo_redo_status()
+            self.update_layer_list()
         else:
             self.status_text.set("Nothing to undo")
     
+    @traced
     def redo(self):
         """Redo the previously undone action"""
-        if self.redo_stack:
-            # Get the next state from redo stack
-            next_state = self.redo_stack.pop()
-            
-            # Add it back to the history stack
-            self.history_stack.append(next_state)
-            
-            # Restore that state
-            self.pil_image = next_state.copy()
-            self.pil_draw = ImageDraw.Draw(self.pil_image)
-            
-            self.update_canvas()
+        if self.session_blocks("Redo"):
+            return
+        self.finish_import()
+        if self.engine.history.can_redo():
+            self.refresh_region(self.engine.redo())
             self.status_text.set("Redo successful")
             self.update_undo_redo_status()
+            self.update_layer_list()
         else:
             self.status_text.set("Nothing to redo")
     
     def update_undo_redo_status(self):
         """Update the enabled/disabled state of undo/redo buttons"""
+        if self.session is not None:
+            # Undo is not part of a shared session
+            self.undo_button.state(['disabled'])
+            self.redo_button.state(['disabled'])
+            return
+        
         # Check undo button
-        if len(self.history_stack) > 1:
+        if self.engine.history.can_undo():
             self.undo_button.state(['!disabled'])
         else:
             self.undo_button.state(['disabled'])
         
         # Check redo button
-        if self.redo_stack:
+        if self.engine.history.can_redo():
             self.redo_button.state(['!disabled'])
         else:
             self.redo_button.state(['disabled'])
     
+    # Layers
+
+    def update_layer_list(self):
+        """Show the engine's layers, top first, with the active one selected"""
+        layers = self.engine.layers
+        self.layer_list.delete(0, tk.END)
+        for layer in reversed(layers.layers):
+            label = ("  " if layer.visible else "x ") + layer.name
+            if layer.opacity < 1:
+                label += f" {round(layer.opacity * 100)}%"
+            self.layer_list.insert(tk.END, label)
+        self.layer_list.selection_set(len(layers) - 1 - layers.active)
+        self.layer_opacity.set(layers.active_layer.opacity * 100)
+
+    def select_layer(self, event=None):
+        selection = self.layer_list.curselection()
+        if selection:
+            self.engine.select_layer(len(self.engine.layers) - 1 - selection[0])
+            self.layer_opacity.set(self.engine.layers.active_layer.opacity * 100)
+            self.status_text.set(f"Drawing on {self.engine.layers.active_layer.name}")
+
+    def layer_changed(self, box, message):
+        """Repaint what a layer operation changed and refresh the controls"""
+        self.refresh_region(box)
+        self.update_layer_list()
+        self.update_undo_redo_status()
+        self.status_text.set(message)
+
+    def add_layer(self):
+        if self.session_blocks("Adding layers"):
+            return
+        self.finish_import()
+        self.engine.add_layer()
+        self.layer_changed(None, f"Added {self.engine.layers.active_layer.name}")
+
+    def delete_layer(self):
+        if self.session_blocks("Deleting layers"):
+            return
+        self.finish_import()
+        if len(self.engine.layers) < 2:
+            self.status_text.set("The last layer cannot be deleted")
+            return
+        name = self.engine.layers.active_layer.name
+        self.layer_changed(self.engine.remove_layer(self.engine.layers.active), f"Deleted {name}")
+
+    def move_layer(self, step):
+        if self.session_blocks("Moving layers"):
+            return
+        self.finish_import()
+        index = self.engine.layers.active
+        self.layer_changed(self.engine.move_layer(index, index + step),
+                           f"Moved {self.engine.layers.active_layer.name} {'up' if step > 0 else 'down'}")
+
+    def toggle_layer(self):
+        if self.session_blocks("Hiding layers"):
+            return
+        self.finish_import()
+        layer = self.engine.layers.active_layer
+        self.layer_changed(self.engine.set_layer_visible(self.engine.layers.active, not layer.visible),
+                           f"{layer.name} {'shown' if layer.visible else 'hidden'}")
+
+    def set_layer_opacity(self):
+        if self.session_blocks("Layer opacity"):
+            self.update_layer_list()
+            return
+        self.finish_import()
+        layer = self.engine.layers.active_layer
+        self.layer_changed(self.engine.set_layer_opacity(self.engine.layers.active, self.layer_opacity.get() / 100),
+                           f"{layer.name} opacity {round(layer.opacity * 100)}%")
+
+    def merge_layer_down(self):
+        if self.session_blocks("Merging layers"):
+            return
+        self.finish_import()
+        index = self.engine.layers.active
+        if index == 0:
+            self.status_text.set("Nothing below to merge into")
+            return
+        name = self.engine.layers.active_layer.name
+        self.layer_changed(self.engine.merge_down(index), f"Merged {name} down")
+
     def clear_canvas(self):
+        self.finish_import()
         if messagebox.askyesno("Clear Canvas", "Are you sure you want to clear the canvas?"):
-            self.pil_image = Image.new("RGBA", (self.canvas_width, self.canvas_height), (255, 255, 255, 0))
-            self.pil_draw = ImageDraw.Draw(self.pil_image)
+            self.engine.clear()
             self.update_canvas()
-            self.save_state()  # Save the cleared state for undo
+            self.update_undo_redo_status()
             self.status_text.set("Canvas cleared")
     
+    def restore_autosave(self):
+        """Offer to rebuild the drawing from the journal left by a session that did not close properly"""
+        if not self.journal.exists():
+            return
+        if not messagebox.askyesno("Restore Drawing", "Doodle did not close properly last time. Restore the unsaved drawing?"):
+            return
+        try:
+            self.journal.recover(self.engine)
+            self.status_text.set("Drawing restored")
+        except Exception as e:
+            # Keep whatever was restored before the failure
+            messagebox.showerror("Error", f"Failed to restore the whole drawing: {str(e)}")
+        self.update_canvas()
+        self.update_layer_list()
+    
+    def close(self):
+        """Quitting normally: finish writing and drop the autosave journal"""
+        self.finish_import()
+        if tracer.enabled:
+            self.toggle_tracing()
+        if self.importer is not None:
+            self.importer.shutdown(wait=False)
+        self.leave_session()
+        if self.startup_job is not None:
+            # Closed before the autosave was looked at: leave it for next time
+            self.root.after_cancel(self.startup_job)
+        else:
+            self.journal.close(discard=True)
+        self.root.destroy()
+    
+    # Shared sessions
+
+    def join_session(self, address):
+        """Share the drawing with a doodle_collab server at host[:port]; it replaces the current drawing"""
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        self.finish_import()
+        self.session = doodle_collab.Session(self.engine)
+        self.session_thread = doodle_collab.SessionThread(self.session, host, int(port or doodle_collab.PORT))
+        self.update_undo_redo_status()
+        self.status_text.set(f"Joining the shared drawing at {address}...")
+        self.session_job = self.root.after(30, self.poll_session)
+
+    def poll_session(self):
+        """Apply what the other peers drew; runs on the Tk event loop"""
+        self.session_job = None
+        # Operations go in between strokes and imports, never in the middle of one
+        if self.engine.last_point is None and self.import_state is None and self.import_future is None:
+            box = self.session.sync()
+            if self.session.snapshots != self.session_snapshots:
+                # The whole document was replaced; crash recovery starts from it
+                self.session_snapshots = self.session.snapshots
+                self.journal.checkpoint()
+                self.viewport.reset()
+                self.update_canvas()
+                self.update_layer_list()
+                self.status_text.set("Joined the shared drawing")
+            elif box is not None:
+                self.refresh_region(box)
+        if not self.session_thread.alive:
+            error = self.session_thread.error
+            self.leave_session()
+            self.status_text.set(f"Left the shared drawing: {error}" if error else "Left the shared drawing")
+            return
+        self.session_job = self.root.after(30, self.poll_session)
+
+    def leave_session(self):
+        if self.session is None:
+            return
+        if self.session_job is not None:
+            self.root.after_cancel(self.session_job)
+            self.session_job = None
+        self.session_thread.stop()
+        self.session.close()
+        self.session = None
+        self.session_thread = None
+        self.update_undo_redo_status()
+
+    def session_blocks(self, action):
+        """True, saying so in the status bar, if action cannot be done because the drawing is shared"""
+        if self.session is None:
+            return False
+        self.status_text.set(f"{action} is not shared, so it is off while drawing together")
+        return True
+
+    def toggle_tracing(self):
+        """Start timing handlers and repaints, or stop and write the trace to ~/.doodle/traces"""
+        if not tracer.enabled:
+            tracer.start()
+            self.status_text.set("Performance tracing on (F12 to stop and save the trace)")
+            self.update_perf_readout()
+            return
+        tracer.stop()
+        if self.perf_job is not None:
+            self.root.after_cancel(self.perf_job)
+            self.perf_job = None
+        self.perf_text.set("")
+        try:
+            path = tracer.dump(os.environ.get("DOODLE_TRACE_FILE") or default_trace_path())
+            self.status_text.set(f"Trace saved to {path}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save the trace: {str(e)}")
+    
+    def update_perf_readout(self):
+        """Show frame rate, frame time, events per second and undo memory; twice a second while tracing"""
+        fps, mean, slowest = tracer.frame_stats()
+        events = tracer.events_per_second()
+        history = self.engine.history.nbytes
+        self.perf_text.set(f"{fps:3.0f} FPS  {mean:5.1f} ms/frame (max {slowest:5.1f})  "
+                           f"{events:4.0f} events/s  undo {history / (1024 * 1024):.1f} MB")
+        tracer.counter("frames", fps=fps, mean_ms=mean, max_ms=slowest)
+        tracer.counter("events", per_second=events)
+        tracer.counter("history", bytes=history)
+        self.perf_job = self.root.after(500, self.update_perf_readout)
+    
+    @traced
     def save_image(self, format_type):
-        file_types = []
-        if format_type == "png":
-            file_types = [('PNG files', '*.png')]
-            default_extension = ".png"
-        elif format_type == "jpeg":
-            file_types = [('JPEG files', '*.jpg')]
-            default_extension = ".jpg"
-        elif format_type == "ico":
-            file_types = [('Icon files', '*.ico')]
-            default_extension = ".ico"
+        default_extension, file_types = doodle_export.FORMATS[format_type]
         
         file_path = filedialog.asksaveasfilename(defaultextension=default_extension,
                                             filetypes=file_types, 
                                             title="Save As")
         
         if file_path:
+            self.start_export([(file_path, format_type)])
+    
+    @traced
+    def save_project(self):
+        """Save layers and undo history to the project file; after the first save only changes are written"""
+        self.finish_import()
+        if self.project is None:
+            file_path = filedialog.asksaveasfilename(defaultextension=doodle_project.PROJECT_EXTENSION,
+                                                filetypes=doodle_project.PROJECT_FILETYPES,
+                                                title="Save Project")
+            if not file_path:
+                return
+            self.project = doodle_project.Project(file_path)
+        try:
+            self.project.save(self.engine)
+            self.status_text.set(f"Project saved to {os.path.basename(self.project.path)}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save project: {str(e)}")
+    
+    @traced
+    def load_project(self):
+        """Open a .doodle project; its tiles are read from disk as they come into view"""
+        if self.session_blocks("Opening a project"):
+            return
+        file_path = filedialog.askopenfilename(filetypes=doodle_project.PROJECT_FILETYPES, title="Open Project")
+        if not file_path:
+            return
+        self.finish_import()
+        try:
+            self.project = doodle_project.open_project(file_path, self.engine)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open project: {str(e)}")
+            return
+        self.viewport.reset()
+        self.update_canvas()
+        self.update_layer_list()
+        self.update_undo_redo_status()
+        # Crash recovery starts from the opened project
+        self.journal.checkpoint()
+        self.status_text.set(f"Opened {os.path.basename(file_path)}")
+    
+    @traced
+    def import_image(self):
+        """Decode an image file on the worker thread, scaled to fit the drawing, then paste it onto a new layer"""
+        if self.session_blocks("Importing images"):
+            return
+        file_path = filedialog.askopenfilename(filetypes=doodle_import.IMPORT_FILETYPES, title="Import Image")
+        if not file_path:
+            return
+        try:
+            if self.importer is None:
+                self.importer = doodle_import.BackgroundImporter()
+            future = self.importer.submit(file_path, (self.engine.width, self.engine.height))
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to import image: {str(e)}")
+            return
+        self.import_future = (future, file_path)
+        self.status_text.set(f"Loading {os.path.basename(file_path)}...")
+        if self.import_job is None:
+            self.import_job = self.root.after(0 if future.done() else 50, self.poll_import)
+    
+    def poll_import(self):
+        """Wait for the decode, then paste as many rows as fit in one frame; runs on the Tk event loop"""
+        self.import_job = None
+        if self.import_state is None and self.import_future is not None:
+            future, file_path = self.import_future
+            if not future.done():
+                self.import_job = self.root.after(50, self.poll_import)
+                return
+            self.import_future = None
             try:
-                if format_type == "jpeg":
-                    # For JPEG, convert to RGB and fill transparency with white
-                    rgb_image = Image.new("RGB", self.pil_image.size, (255, 255, 255))
-                    rgb_image.paste(self.pil_image, mask=self.pil_image.split()[3])
-                    rgb_image.save(file_path, "JPEG", quality=95)
-                elif format_type == "ico":
-                    # For ICO, resize if needed and save
-                    ico_image = self.pil_image.copy()
-                    
-                    # Get the maximum dimension and scale it to 48px if larger
-                    max_dim = max(ico_image.width, ico_image.height)
-                    if max_dim > 48:
-                        scale_factor = 48 / max_dim
-                        new_width = int(ico_image.width * scale_factor)
-                        new_height = int(ico_image.height * scale_factor)
-                        ico_image = ico_image.resize((new_width, new_height), Image.LANCZOS)
-                        
-                    # Save as ICO
-                    ico_image.save(file_path, format="ICO")
-                else:  # PNG
-                    self.pil_image.save(file_path, "PNG")
-                
-                self.status_text.set(f"Saved as {os.path.basename(file_path)}")
-                messagebox.showinfo("Save Successful", f"File saved successfully to:\n{file_path}")
+                image = future.result()
             except Exception as e:
-                messagebox.showerror("Save Error", f"Error saving file: {str(e)}")
+                messagebox.showerror("Error", f"Failed to import image: {str(e)}")
+                return
+            # Centered on the drawing
+            position = ((self.engine.width - image.width) // 2, (self.engine.height - image.height) // 2)
+            self.engine.begin_import(os.path.basename(file_path))
+            self.update_layer_list()
+            self.import_state = (image, position, file_path, 0)
+        
+        if self.import_state is not None:
+            self.paste_import_rows(1.0 / self.frame_rate)
+            if self.import_state is not None:
+                self.import_job = self.root.after(1, self.poll_import)
+            elif self.import_future is not None:
+                self.import_job = self.root.after(50, self.poll_import)
+    
+    @traced
+    def paste_import_rows(self, budget):
+        """Paste bands of one tile row each until budget seconds have passed (None: until done)"""
+        image, position, file_path, row = self.import_state
+        band = self.engine.layers.tile_size
+        deadline = None if budget is None else time.perf_counter() + budget
+        while row < image.height and (deadline is None or time.perf_counter() < deadline):
+            # Bands line up with tile rows, so each tile is written once
+            bottom = min(image.height, row + band - (position[1] + row) % band)
+            self.refresh_region(self.engine.import_rows(image, position, row, bottom))
+            row = bottom
+        if row < image.height:
+            self.import_state = (image, position, file_path, row)
+            return
+        self.import_state = None
+        self.engine.end_import(image, position, file_path)
+        self.update_layer_list()
+        self.update_undo_redo_status()
+        self.status_text.set(f"Imported {os.path.basename(file_path)}")
+    
+    def finish_import(self):
+        """Paste the rest of an import in progress at once, before anything else changes the drawing"""
+        if self.import_state is not None:
+            self.paste_import_rows(None)
+    
+    def save_all_formats(self):
+        """Save the drawing as PNG, JPEG and ICO side by side, encoding all three in parallel"""
+        file_path = filedialog.asksaveasfilename(title="Save All Formats (extension is added per format)")
+        
+        if file_path:
+            base = os.path.splitext(file_path)[0]
+            self.start_export([(base + doodle_export.FORMATS[format_type][0], format_type) for format_type in ("png", "jpeg", "ico")])
+    
+    @traced
+    def start_export(self, targets):
+        """Snapshot the drawing and encode it on the worker pool so drawing can continue"""
+        if self.exporter is None:
+            self.exporter = doodle_export.BackgroundExporter()
+        self.exporter.submit(self.engine.snapshot(), targets, self.engine.background)
+        self.status_text.set(f"Saving {', '.join(os.path.basename(path) for path, _ in targets)}...")
+        if self.export_poll_job is None:
+            self.export_poll_job = self.root.after(50, self.poll_exports)
+    
+    def poll_exports(self):
+        """Report progress and results of background saves; runs on the Tk event loop"""
+        self.export_poll_job = None
+        
+        for job in self.exporter.poll():
+            errors = job.errors()
+            if errors:
+                details = "\n".join(f"{path}: {error}" for path, error in errors)
+                messagebox.showerror("Save Error", f"Error saving file: {details}")
+            else:
+                names = ", ".join(os.path.basename(path) for path, _ in job.targets)
+                self.status_text.set(f"Saved as {names}")
+        
+        pending = self.exporter.pending()
+        if pending:
+            done = sum(job.completed() for job in pending)
+            total = sum(len(job.targets) for job in pending)
+            self.status_text.set(f"Saving... {done}/{total} files written")
+            self.export_poll_job = self.root.after(50, self.poll_exports)
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Doodle drawing app")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each phase of startup took")
+    parser.add_argument("--join", metavar="HOST[:PORT]",
+                        help="draw together with everyone on a doodle_collab.py server")
+    parser.add_argument("--width", type=int, default=800, help="width of a new drawing in pixels")
+    parser.add_argument("--height", type=int, default=800, help="height of a new drawing in pixels")
+    args = parser.parse_args()
+    if not (0 < args.width <= 65535 and 0 < args.height <= 65535):
+        parser.error("the drawing must be between 1 and 65535 pixels across")
+
+    profile = StartupProfile(STARTED) if args.profile_startup else None
+    if profile is not None:
+        profile.mark("imports")
     root = tk.Tk()
-    app = DoodleApp(root)
+    if profile is not None:
+        profile.mark("tk root")
+    app = DoodleApp(root, profile, args.join, drawing_size=(args.width, args.height))
     root.mainloop()
@@ -6,7 +6,9 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('doodle_icon.ico', '.')],
-    hiddenimports=[],
+    # Modules doodle.py loads through lazy_import(), which analysis cannot see
+    hiddenimports=['tkinter.filedialog', 'tkinter.messagebox', 'doodle_collab', 'doodle_export',
+                   'doodle_import', 'doodle_project'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
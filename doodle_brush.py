@@ -0,0 +1,148 @@
+"""Brush engine for Doodle: anti-aliased round dabs stamped along the stroke.
+
+A stroke is a row of dabs a fixed distance apart along its path (a quarter
+of the brush size), rather than a polyline rasterised segment by segment,
+so wide brushes have smooth edges and no gaps or notches at the joints,
+and any size works, fractions of a pixel included.
+
+Each dab mask is rendered once per (size, hardness, sub-pixel position) by
+drawing the disc at SUPERSAMPLE times the resolution and averaging it down,
+then kept in an LRU cache; drawing a stroke is then only pasting cached
+masks.  The dabs landing on a tile are merged into one coverage mask and the
+colour is composited onto the tile once through it, which gives the same
+result as compositing every dab in turn, since they all share the colour.
+The eraser takes the same coverage out of the tiles' alpha channel.
+"""
+import math
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from doodle_tiles import BLANK
+
+SUPERSAMPLE = 4  # Per axis, when rendering a dab mask
+PHASES = 4  # Sub-pixel positions per axis a dab can be placed at
+SPACING = 0.25  # Distance between dabs as a fraction of the brush size
+MIN_SPACING = 1.0  # Pixels; tiny brushes would otherwise stamp several dabs per pixel
+
+
+def spacing(size):
+    return max(MIN_SPACING, size * SPACING)
+
+
+@lru_cache(maxsize=256)
+def dab_mask(size, hardness, phase_x, phase_y):
+    """Coverage (L mode) of a disc size pixels across, centred phase / PHASES of a pixel
+    right of and below the corner of the mask's middle pixel.
+
+    hardness 1 gives a disc with a one pixel anti-aliased edge; lower values fade the edge over that
+    fraction of the radius.
+    """
+    radius = max(size, 1) / 2
+    extent = math.ceil(radius) + 1
+    centre_x = extent + phase_x / PHASES
+    centre_y = extent + phase_y / PHASES
+    softness = (1 - hardness) * radius
+    core = radius - softness / 2  # A blurred disc of this radius fades out around radius
+
+    scale = SUPERSAMPLE
+    mask = Image.new("L", ((2 * extent + 1) * scale,) * 2, 0)
+    ImageDraw.Draw(mask).ellipse([(centre_x - core) * scale, (centre_y - core) * scale,
+                                  (centre_x + core) * scale - 1, (centre_y + core) * scale - 1], fill=255)
+    mask = mask.reduce(scale)
+    if softness > 0:
+        mask = mask.filter(ImageFilter.GaussianBlur(softness / 2))
+    return mask
+
+
+def dab_positions(points, step, travelled=0.0):
+    """Dab centres every step pixels along a polyline given as a flat [x, y, x, y, ...] list.
+
+    travelled is how far the stroke has gone since its last dab, so a stroke
+    drawn a few points at a time gets the same dabs as one drawn at once.
+    Returns the centres and the new travelled distance.
+    """
+    positions = []
+    for i in range(2, len(points), 2):
+        x0, y0, x1, y1 = points[i - 2:i + 2]
+        length = math.hypot(x1 - x0, y1 - y0)
+        distance = step - travelled  # Along this segment to the next dab
+        while distance <= length:
+            t = distance / length
+            positions.append((x0 + (x1 - x0) * t, y0 + (y1 - y0) * t))
+            distance += step
+        travelled = length - (distance - step)
+    return positions, travelled
+
+
+class Stroke:
+    """One brush or eraser stroke on a TiledCanvas.
+
+    The stroke keeps the combined coverage of its dabs for every tile it
+    reaches, and redraws a tile from how it looked before the stroke each
+    time more dabs land on it.  The pixels therefore depend only on where
+    the dabs fell, not on how the stroke was split into stamp() calls, so a
+    stroke replayed in one go comes out exactly the same.
+    """
+
+    def __init__(self, canvas, size, hardness=1.0, color=None):
+        self.canvas = canvas
+        self.size = size
+        self.hardness = hardness
+        self.color = color  # None erases
+        self.extent = math.ceil(max(size, 1) / 2) + 1  # From a dab's centre pixel to its mask's edge
+        self.before = {}  # key -> tile as it was before the stroke, None if blank
+        self.coverage = {}  # key -> L mask of the stroke so far
+        self.travelled = 0.0  # Distance along the path since the last dab
+
+    def follow(self, points):
+        """Stamp dabs along a polyline given as a flat [x, y, x, y, ...] list, continuing the spacing
+        from the previous call; returns the keys of the tiles reached"""
+        positions, self.travelled = dab_positions(points, spacing(self.size), self.travelled)
+        return self.stamp(positions)
+
+    def stamp(self, positions):
+        """Stamp a dab at each (x, y) pixel position; returns the keys of the tiles reached"""
+        canvas = self.canvas
+        size = canvas.tile_size
+        # Group the dabs by tile, so each tile is redrawn once
+        by_tile = {}
+        for x, y in positions:
+            # Pixel (x, y) is centred on x + 0.5, y + 0.5
+            column, phase_x = divmod(round((x + 0.5) * PHASES), PHASES)
+            row, phase_y = divmod(round((y + 0.5) * PHASES), PHASES)
+            mask = dab_mask(self.size, self.hardness, phase_x, phase_y)
+            box = (column - self.extent, row - self.extent,
+                   column - self.extent + mask.width, row - self.extent + mask.height)
+            for key in canvas.keys_in(box):
+                by_tile.setdefault(key, []).append((mask, box))
+
+        for key, dabs in by_tile.items():
+            if key not in self.coverage:
+                self.before[key] = canvas.get(key)
+                self.coverage[key] = Image.new("L", (size, size), 0)
+            before = self.before[key]
+            if self.color is None and before is None:
+                continue  # Nothing to erase
+
+            # Pasting 255 through a mask combines coverages like alpha does: c = c + m * (1 - c)
+            coverage = self.coverage[key]
+            left, top = key[0] * size, key[1] * size
+            for mask, box in dabs:
+                coverage.paste(255, (box[0] - left, box[1] - top, box[2] - left, box[3] - top), mask)
+
+            if self.color is None:
+                alpha = before.getchannel("A")
+                alpha.paste(0, None, coverage)  # alpha * (1 - coverage)
+                tile = before.copy()
+                tile.putalpha(alpha)
+            else:
+                # Dabs of one color over each other are that color at their combined coverage.
+                # A new tile starts from BLANK like any other, so the pixels the stroke leaves
+                # transparent come out the same whether or not the tile existed before.
+                tile = Image.new("RGBA", (size, size), self.color)
+                tile.putalpha(coverage)
+                tile = Image.alpha_composite(before if before is not None else Image.new("RGBA", (size, size), BLANK),
+                                             tile)
+            canvas.replace_tile(key, tile)
+        return set(by_tile)
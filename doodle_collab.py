@@ -0,0 +1,693 @@
+"""Shared drawing sessions for Doodle over a LAN: a small asyncio server and client.
+
+Peers never send pixels.  Every stroke, shape fill, background fill and
+clear a peer commits is sent as its operation (the same dict the engine
+records, see DoodleEngine.listeners) in a compact binary form, and every
+peer rasterises the operations itself with its own engine.
+
+Ordering is decided by the server: it numbers operations in the order they
+arrive and sends them, numbered, to every peer, the sender included.  A
+peer applies its own operations straight away so drawing never waits on the
+network, and keeps them as pending until they come back.  If another
+peer's operation was numbered first, the pending ones are undone, the other
+operation applied, and the pending ones applied again on top, so every
+peer ends up having applied the same operations in the same order and
+holds the same pixels.
+
+A peer joining late gets a snapshot (the tiles of the drawing as of some
+operation number, zlib-compressed) and then the operations numbered after
+it.  The server keeps the snapshot up to date by applying the operations
+to an engine of its own on a worker thread every SNAPSHOT_EVERY operations.
+
+Wire format: every message is a frame of a 4-byte big-endian payload
+length, a 1-byte message type and the payload.  Operations are batched:
+a peer sends whatever it committed in the last BATCH_INTERVAL in one OPS
+frame, and the server sends everything it numbered in that time in one
+ORDERED frame.  Stroke points are sent as zigzag varint deltas from the
+previous point, which is one or two bytes per coordinate for a hand-drawn
+line.
+
+A session shares a single layer; layer changes, imports and undo/redo are
+not part of it.
+
+Run a server with:
+python doodle_collab.py --port 8765
+"""
+import asyncio
+import math
+import struct
+import threading
+from collections import deque
+
+from PIL import ImageColor
+
+from doodle_engine import DoodleEngine
+from doodle_layers import Layer
+from doodle_tiles import TiledCanvas, decode_tile, encode_tile, union_box
+
+PORT = 8765
+VERSION = 1
+BATCH_INTERVAL = 0.02  # Seconds of operations sent together in one frame
+SNAPSHOT_EVERY = 500  # Operations between the server's snapshots for late joiners
+MAX_FRAME = 64 * 1024 * 1024  # Bytes; anything larger is a broken or hostile peer
+MAX_BUFFER = 16 * 1024 * 1024  # Bytes queued for a peer before it is dropped as too far behind
+
+# Limits on what an operation may ask of the peers that apply it
+MAX_SIZE = 256  # Brush pixels across, well past the app's largest brush
+MAX_TOLERANCE = 4 * 255  # Fill tolerance is a summed RGBA difference
+MAX_COORDINATE = 1 << 16  # Points may lie off the canvas, but not absurdly far
+
+# Message types
+HELLO = 1  # peer -> server: protocol version
+WELCOME = 2  # server -> peer: the peer's id
+SNAPSHOT = 3  # server -> peer: the drawing as of an operation number
+OPS = 4  # peer -> server: operations committed since the last frame
+ORDERED = 5  # server -> peers: numbered operations, each with the id of the peer that sent it
+ERROR = 6  # server -> peer: why the connection is being closed
+
+# Operation codes, and the engine operations a session shares
+STROKE = 1
+FILL_SHAPE = 2
+FILL_BACKGROUND = 3
+CLEAR = 4
+SHARED_OPERATIONS = {"stroke", "fill_shape", "fill_background", "clear"}
+
+# Stroke flags
+ERASER = 1
+FLOAT_POINTS = 2  # Points sent as doubles, for scripts that use fractional coordinates
+
+HEADER = struct.Struct(">IB")
+
+
+# Varints
+
+def write_varint(out, value):
+    """Append an unsigned int to the bytearray out, 7 bits per byte, low bits first"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    """(value, offset after it) for the varint at offset"""
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_signed(out, value):
+    # Zigzag: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ... so small deltas of either sign stay small
+    write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def read_signed(data, offset):
+    value, offset = read_varint(data, offset)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+
+# Operations
+
+def pack_color(color):
+    rgba = ImageColor.getrgb(color)
+    return bytes(rgba if len(rgba) == 4 else rgba + (255,))
+
+
+def unpack_color(data):
+    if data[3] == 255:
+        return "#%02X%02X%02X" % tuple(data[:3])
+    return "#%02X%02X%02X%02X" % tuple(data)
+
+
+def encode_operation(operation):
+    """Binary form of one shared engine operation"""
+    kind = operation["op"]
+    out = bytearray()
+    if kind == "stroke":
+        points = operation["points"]
+        whole = all(isinstance(value, int) for value in points)
+        out.append(STROKE)
+        out.append((ERASER if operation["tool"] == "eraser" else 0) | (0 if whole else FLOAT_POINTS))
+        out += pack_color(operation["color"])
+        out += struct.pack(">dd", operation["size"], operation["hardness"])
+        write_varint(out, len(points))
+        if whole:
+            previous = 0
+            for value in points[0::2]:
+                write_signed(out, value - previous)
+                previous = value
+            previous = 0
+            for value in points[1::2]:
+                write_signed(out, value - previous)
+                previous = value
+        else:
+            out += struct.pack(f">{len(points)}d", *points)
+    elif kind == "fill_shape":
+        out.append(FILL_SHAPE)
+        out += pack_color(operation["color"])
+        write_varint(out, operation["tolerance"])
+        write_signed(out, operation["x"])
+        write_signed(out, operation["y"])
+    elif kind == "fill_background":
+        color = operation["color"]
+        out.append(FILL_BACKGROUND)
+        out += b"\0" * 5 if color is None else b"\1" + pack_color(color)
+    elif kind == "clear":
+        out.append(CLEAR)
+    else:
+        raise ValueError(f"{kind!r} operations are not shared")
+    return bytes(out)
+
+
+def check_operation(operation):
+    """Raise ValueError unless a decoded operation is within what the engine can apply"""
+    if operation["op"] == "stroke":
+        if not (math.isfinite(operation["size"]) and 0 <= operation["size"] <= MAX_SIZE):
+            raise ValueError(f"brush size {operation['size']} is out of range")
+        if not (math.isfinite(operation["hardness"]) and 0 <= operation["hardness"] <= 1):
+            raise ValueError(f"brush hardness {operation['hardness']} is out of range")
+        coordinates = operation["points"]
+    elif operation["op"] == "fill_shape":
+        if operation["tolerance"] > MAX_TOLERANCE:
+            raise ValueError(f"fill tolerance {operation['tolerance']} is out of range")
+        coordinates = (operation["x"], operation["y"])
+    else:
+        return
+    # NaN fails both comparisons, infinities the second
+    if not all(-MAX_COORDINATE <= value <= MAX_COORDINATE for value in coordinates):
+        raise ValueError("coordinates are out of range")
+
+
+def decode_operation(data):
+    """The engine operation dict encoded in data; raises ValueError if it is malformed or out of range"""
+    try:
+        code = data[0]
+        if code == STROKE:
+            flags = data[1]
+            color = unpack_color(data[2:6])
+            size, hardness = struct.unpack_from(">dd", data, 6)
+            count, offset = read_varint(data, 22)
+            if count % 2 or count == 0:
+                raise ValueError("a stroke needs whole points")
+            if flags & FLOAT_POINTS:
+                points = list(struct.unpack_from(f">{count}d", data, offset))
+                offset += count * 8
+            else:
+                points = [0] * count
+                for start in (0, 1):
+                    value = 0
+                    for i in range(start, count, 2):
+                        delta, offset = read_signed(data, offset)
+                        value += delta
+                        points[i] = value
+            operation = {"op": "stroke", "tool": "eraser" if flags & ERASER else "brush", "color": color,
+                         "size": size, "hardness": hardness, "points": points}
+        elif code == FILL_SHAPE:
+            color = unpack_color(data[1:5])
+            tolerance, offset = read_varint(data, 5)
+            x, offset = read_signed(data, offset)
+            y, offset = read_signed(data, offset)
+            operation = {"op": "fill_shape", "color": color, "x": x, "y": y, "tolerance": tolerance}
+        elif code == FILL_BACKGROUND:
+            offset = 6
+            operation = {"op": "fill_background", "color": unpack_color(data[2:6]) if data[1] else None}
+        elif code == CLEAR:
+            offset = 1
+            operation = {"op": "clear"}
+        else:
+            raise ValueError(f"unknown operation code {code}")
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"truncated operation: {e}") from None
+    if offset != len(data):
+        raise ValueError("trailing bytes after operation")
+    check_operation(operation)
+    return operation
+
+
+# Messages
+
+def frame(kind, payload=b""):
+    return HEADER.pack(len(payload), kind) + payload
+
+
+async def read_frame(reader):
+    """(type, payload) of the next frame; raises asyncio.IncompleteReadError at end of stream"""
+    length, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME:
+        raise ValueError(f"frame of {length} bytes is too large")
+    return kind, await reader.readexactly(length)
+
+
+def encode_batch(operations):
+    """OPS payload for a list of encoded operations"""
+    out = bytearray()
+    write_varint(out, len(operations))
+    for data in operations:
+        write_varint(out, len(data))
+        out += data
+    return bytes(out)
+
+
+def decode_batch(payload):
+    """Encoded operations of an OPS payload"""
+    count, offset = read_varint(payload, 0)
+    operations = []
+    for _ in range(count):
+        length, offset = read_varint(payload, offset)
+        operations.append(payload[offset:offset + length])
+        offset += length
+    if offset != len(payload):
+        raise ValueError("malformed operation batch")
+    return operations
+
+
+def encode_ordered(entries):
+    """ORDERED payload for consecutive (sequence, origin, encoded operation) entries"""
+    out = bytearray(struct.pack(">Q", entries[0][0]))
+    write_varint(out, len(entries))
+    for _, origin, data in entries:
+        write_varint(out, origin)
+        write_varint(out, len(data))
+        out += data
+    return bytes(out)
+
+
+def decode_ordered(payload):
+    """(sequence of the first entry, [(origin, operation dict), ...]) of an ORDERED payload"""
+    first, = struct.unpack_from(">Q", payload)
+    count, offset = read_varint(payload, 8)
+    entries = []
+    for _ in range(count):
+        origin, offset = read_varint(payload, offset)
+        length, offset = read_varint(payload, offset)
+        entries.append((origin, decode_operation(payload[offset:offset + length])))
+        offset += length
+    return first, entries
+
+
+def encode_snapshot(sequence, engine):
+    """SNAPSHOT payload of the drawing on engine's active layer after operation sequence"""
+    canvas = engine.canvas
+    out = bytearray(struct.pack(">QHHH", sequence, canvas.width, canvas.height, canvas.tile_size))
+    out += b"\0" * 5 if engine.background is None else b"\1" + pack_color(engine.background)
+    keys = canvas.painted_keys_in()
+    write_varint(out, len(keys))
+    for key in keys:
+        data = encode_tile(canvas.get(key))
+        write_varint(out, key[0])
+        write_varint(out, key[1])
+        write_varint(out, len(data))
+        out += data
+    return bytes(out)
+
+
+def decode_snapshot(payload):
+    """(sequence, background, TiledCanvas) of a SNAPSHOT payload"""
+    sequence, width, height, tile_size = struct.unpack_from(">QHHH", payload)
+    background = unpack_color(payload[15:19]) if payload[14] else None
+    canvas = TiledCanvas(width, height, tile_size)
+    count, offset = read_varint(payload, 19)
+    for _ in range(count):
+        column, offset = read_varint(payload, offset)
+        row, offset = read_varint(payload, offset)
+        length, offset = read_varint(payload, offset)
+        canvas.replace_tile((column, row), decode_tile(payload[offset:offset + length], tile_size))
+        offset += length
+    return sequence, background, canvas
+
+
+# Peer side
+
+class Session:
+    """One peer's side of a shared drawing: keeps its engine in the server's order.
+
+    Everything here runs on the thread that owns the engine.  The network
+    side (SessionClient) only touches the two queues: it sends what is in
+    outgoing and puts what the server sent in incoming, and sync() applies
+    that to the engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.client_id = None  # Given by the server
+        self.sequence = 0  # Number of the last ordered operation applied
+        self.pending = []  # [operation, serial of its undo entry or None] sent but not yet ordered, oldest first
+        self.outgoing = deque()  # Encoded operations for the network side to send
+        self.incoming = deque()  # Decoded messages from the network side
+        self.applying = False  # Set while sync() drives the engine, whose operations are not new
+        self.snapshots = 0  # Snapshots loaded, each of which replaced the whole document
+        self.serial = engine.history.serial  # Undo history serial after the last operation seen
+        engine.listeners.append(self.record)
+
+    def close(self):
+        self.engine.listeners.remove(self.record)
+        self.engine.history.keep_from = None
+
+    def record(self, operation):
+        """Engine listener: send an operation committed on this peer"""
+        history = self.engine.history
+        serial = history.serial if history.serial != self.serial else None
+        self.serial = history.serial
+        if self.applying or operation["op"] not in SHARED_OPERATIONS:
+            return
+        self.pending.append([operation, serial])
+        self.outgoing.append(encode_operation(operation))
+        self._keep_pending()
+
+    def sync(self):
+        """Apply everything received since the last call; returns the box that changed.
+
+        The engine must not be in the middle of a stroke or an import.
+        """
+        changed = None
+        engine = self.engine
+        tools = (engine.mode, engine.current_color, engine.brush_size, engine.brush_hardness, engine.fill_tolerance)
+        self.applying = True
+        try:
+            while self.incoming:
+                message = self.incoming.popleft()
+                if message[0] == "welcome":
+                    self.client_id = message[1]
+                elif message[0] == "snapshot":
+                    changed = self._load(*message[1:])
+                else:
+                    changed = union_box(changed, self._apply_ordered(*message[1:]))
+        finally:
+            self.applying = False
+            self.serial = engine.history.serial
+            # Applying other peers' operations sets the tools they used; give this peer its own back
+            (engine.mode, engine.current_color, engine.brush_size, engine.brush_hardness,
+             engine.fill_tolerance) = tools
+        return changed
+
+    def _load(self, sequence, background, canvas):
+        engine = self.engine
+        engine.load([Layer("Shared drawing", canvas)], background)
+        self.sequence = sequence
+        self.snapshots += 1
+        # Anything drawn before the snapshot arrived is still on its way to the server
+        for entry in self.pending:
+            entry[1] = self._apply(entry[0])[1]
+        self._keep_pending()
+        return (0, 0, engine.width, engine.height)
+
+    def _apply(self, operation):
+        """Apply an operation; returns the changed box and the serial of the undo entry it made, if any"""
+        history = self.engine.history
+        serial = history.serial
+        box = self.engine.apply(operation)
+        return box, history.serial if history.serial != serial else None
+
+    def _keep_pending(self):
+        """Stop the undo history's byte budget from dropping the entries of pending operations, which
+        have to be undone if another peer's operation is ordered before them"""
+        serials = [serial for _, serial in self.pending if serial is not None]
+        self.engine.history.keep_from = serials[0] if serials else None
+
+    def _rewind(self):
+        """Undo this peer's pending operations, newest first; returns the box that changed"""
+        serials = [serial for _, serial in self.pending if serial is not None]
+        stack = self.engine.history.undo_stack
+        if len(serials) > len(stack) or any(stack[-1 - i].serial != serial
+                                            for i, serial in enumerate(reversed(serials))):
+            raise RuntimeError("the undo history no longer holds this peer's pending operations")
+        changed = None
+        for _ in serials:
+            changed = union_box(changed, self.engine.undo())
+        return changed
+
+    def _apply_ordered(self, first, entries):
+        changed = None
+        rewound = False
+        for sequence, (origin, operation) in enumerate(entries, first):
+            if sequence <= self.sequence:
+                continue  # Already in the snapshot
+            self.sequence = sequence
+            if origin == self.client_id and self.pending:
+                operation, _ = self.pending.pop(0)
+                if not rewound:
+                    continue  # Already applied, and nothing came before it
+            elif self.pending and not rewound:
+                # Take this peer's pending operations off, so the other one goes under them
+                changed = union_box(changed, self._rewind())
+                rewound = True
+            changed = union_box(changed, self._apply(operation)[0])
+        if rewound:
+            for entry in self.pending:
+                box, entry[1] = self._apply(entry[0])
+                changed = union_box(changed, box)
+        self._keep_pending()
+        return changed
+
+
+class SessionClient:
+    """Network side of a Session: connects to a server, sends batches and queues what arrives.
+
+    on_message, if given, is called after each message is queued; headless
+    peers pass session.sync to apply messages as they arrive.
+    """
+
+    def __init__(self, session, host="127.0.0.1", port=PORT, batch_interval=BATCH_INTERVAL, on_message=None):
+        self.session = session
+        self.host = host
+        self.port = port
+        self.batch_interval = batch_interval
+        self.on_message = on_message
+        self.connected = False
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def run(self):
+        """Connect and exchange operations until the server closes the connection or the task is cancelled"""
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        flusher = None
+        try:
+            writer.write(frame(HELLO, struct.pack(">H", VERSION)))
+            while True:
+                kind, payload = await read_frame(reader)
+                self.bytes_received += HEADER.size + len(payload)
+                if kind == WELCOME:
+                    self._queue(("welcome", struct.unpack(">I", payload)[0]))
+                elif kind == SNAPSHOT:
+                    self._queue(("snapshot",) + decode_snapshot(payload))
+                    if flusher is None:
+                        self.connected = True
+                        flusher = asyncio.create_task(self._flush(writer))
+                elif kind == ORDERED:
+                    self._queue(("ordered",) + decode_ordered(payload))
+                elif kind == ERROR:
+                    raise ConnectionError(payload.decode("utf-8", "replace"))
+                else:
+                    raise ValueError(f"unexpected message type {kind}")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("the server closed the session") from None
+        finally:
+            self.connected = False
+            if flusher is not None:
+                flusher.cancel()
+            writer.close()
+
+    def _queue(self, message):
+        self.session.incoming.append(message)
+        if self.on_message is not None:
+            self.on_message()
+
+    async def _flush(self, writer):
+        outgoing = self.session.outgoing
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            if not outgoing:
+                continue
+            batch = []
+            while outgoing:
+                batch.append(outgoing.popleft())
+            data = frame(OPS, encode_batch(batch))
+            self.bytes_sent += len(data)
+            writer.write(data)
+            await writer.drain()
+
+
+class SessionThread:
+    """Runs a SessionClient on an event loop of its own, for a peer whose engine lives on the Tk thread"""
+
+    def __init__(self, session, host="127.0.0.1", port=PORT):
+        self.client = SessionClient(session, host, port)
+        self.error = None  # Why the connection ended, once it has
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.client.run())
+        self.thread = threading.Thread(target=self._run, name="doodle-session", daemon=True)
+        self.thread.start()
+
+    @property
+    def alive(self):
+        return self.thread.is_alive()
+
+    def _run(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """Disconnect and wait for the thread to end"""
+        try:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        except RuntimeError:
+            pass  # The loop has already finished
+        self.thread.join()
+
+
+# Server side
+
+class SessionServer:
+    def __init__(self, width=800, height=800, tile_size=64, snapshot_every=SNAPSHOT_EVERY,
+                 batch_interval=BATCH_INTERVAL, max_buffer=MAX_BUFFER):
+        self.snapshot_every = snapshot_every
+        self.batch_interval = batch_interval
+        self.max_buffer = max_buffer
+
+        self.sequence = 0  # Number given to the last operation received
+        self.sent = 0  # Number of the last operation sent out to the peers
+        self.log = []  # (sequence, origin, encoded operation) after the snapshot, oldest first
+        self.clients = {}  # Peer id -> StreamWriter
+        self.handlers = set()  # Connection tasks, so close() can wait for them
+        self.next_id = 0
+
+        # Only the snapshot job touches this engine, on a worker thread, one job at a time
+        self.engine = DoodleEngine(width, height, history_budget=0, tile_size=tile_size)
+        self.snapshot = (0, encode_snapshot(0, self.engine))  # (sequence, SNAPSHOT payload)
+        self.snapshot_job = None
+
+        self.server = None
+        self.port = None
+        self.broadcaster = None
+
+    async def start(self, host="0.0.0.0", port=PORT):
+        """Start listening (port 0 picks a free one, see self.port)"""
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.broadcaster = asyncio.create_task(self._broadcast_loop())
+
+    async def close(self):
+        self.broadcaster.cancel()
+        self.server.close()
+        for writer in self.clients.values():
+            writer.close()
+        self.clients.clear()
+        # Closing the writers ends the handlers' reads
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        if self.snapshot_job is not None:
+            await self.snapshot_job
+
+    async def _handle(self, reader, writer):
+        client_id = None
+        self.handlers.add(asyncio.current_task())
+        try:
+            kind, payload = await read_frame(reader)
+            if kind != HELLO or struct.unpack_from(">H", payload)[0] != VERSION:
+                writer.write(frame(ERROR, f"this server speaks version {VERSION}".encode("utf-8")))
+                return
+            self.next_id += 1
+            client_id = self.next_id
+
+            # The snapshot, then everything sent out since it; later operations come with the next broadcast
+            sequence, data = self.snapshot
+            writer.write(frame(WELCOME, struct.pack(">I", client_id)))
+            writer.write(frame(SNAPSHOT, data))
+            tail = self.log[:self.sent - sequence]
+            if tail:
+                writer.write(frame(ORDERED, encode_ordered(tail)))
+            self.clients[client_id] = writer
+
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind != OPS:
+                    raise ValueError(f"unexpected message type {kind}")
+                operations = decode_batch(payload)
+                for data in operations:
+                    try:
+                        decode_operation(data)  # Refuse anything the peers could not apply
+                    except ValueError as e:
+                        writer.write(frame(ERROR, f"refused an operation: {e}".encode("utf-8")))
+                        raise
+                for data in operations:
+                    self.sequence += 1
+                    self.log.append((self.sequence, client_id, data))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error, IndexError):
+            pass
+        finally:
+            self.handlers.discard(asyncio.current_task())
+            self.clients.pop(client_id, None)
+            writer.close()
+
+    async def _broadcast_loop(self):
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            self.broadcast()
+
+    def broadcast(self):
+        """Send every operation numbered since the last broadcast to all peers"""
+        entries = self.log[self.sent - self.snapshot[0]:]
+        if entries:
+            data = frame(ORDERED, encode_ordered(entries))
+            self.sent = entries[-1][0]
+            for client_id, writer in list(self.clients.items()):
+                if writer.transport.get_write_buffer_size() > self.max_buffer:
+                    # Too far behind to catch up; it can join again and start from a snapshot
+                    del self.clients[client_id]
+                    writer.close()
+                else:
+                    writer.write(data)
+        if self.snapshot_job is None and self.sent - self.snapshot[0] >= self.snapshot_every:
+            self.snapshot_job = asyncio.create_task(self._take_snapshot(self.sent))
+
+    async def _take_snapshot(self, sequence):
+        start = self.snapshot[0]
+        operations = [data for _, _, data in self.log[:sequence - start]]
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, self._render_snapshot, operations, sequence)
+            del self.log[:sequence - start]
+            self.snapshot = (sequence, data)
+        finally:
+            self.snapshot_job = None
+
+    def _render_snapshot(self, operations, sequence):
+        for data in operations:
+            self.engine.apply(decode_operation(data))
+        return encode_snapshot(sequence, self.engine)
+
+
+async def serve(host="0.0.0.0", port=PORT, width=800, height=800):
+    server = SessionServer(width, height)
+    await server.start(host, port)
+    print(f"Doodle session on port {server.port} ({width}x{height})")
+    await server.server.serve_forever()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Host a shared Doodle drawing session")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.width, args.height))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+"""Headless drawing engine for Doodle.
+
+DoodleEngine owns the raster and every drawing operation (brush, eraser,
+fill shape, background fill, undo/redo, clear and export) without any Tk
+dependency, so it can run on a server or under a profiler.  DoodleApp in
+doodle.py is a view over one engine.
+
+The drawing is a stack of layers (doodle_layers), each a sparse TiledCanvas
+(doodle_tiles), so a large, mostly transparent drawing only costs memory and
+time for the tiles painted on.  Brush, eraser and Fill Shape work on the
+active layer; display and export read the cached composite.  The background
+color is a document property, not pixels: it is put under the composite only
+when displaying and exporting, so changing it costs nothing and erasing
+reveals it.
+
+Each committed action can be recorded as a plain JSON-friendly dict, and a
+list of those dicts can be replayed at full speed with replay():
+
+    {"op": "stroke", "tool": "brush", "color": "#FF5555", "size": 5, "hardness": 1.0, "points": [x0, y0, x1, y1, ...]}
+    {"op": "fill_shape", "color": "#55FF55", "x": 120, "y": 80, "tolerance": 50}
+    {"op": "fill_background", "color": "#FFFFFF"}    (null for a transparent background)
+    {"op": "clear"}
+    {"op": "add_layer", "name": "Layer 2"}
+    {"op": "remove_layer", "index": 1}
+    {"op": "move_layer", "index": 1, "to": 0}
+    {"op": "layer_visible", "index": 1, "visible": false}
+    {"op": "layer_opacity", "index": 1, "opacity": 0.5}
+    {"op": "merge_down", "index": 1}
+    {"op": "select_layer", "index": 0}
+    {"op": "import_image", "path": "photo.jpg", "name": "photo.jpg", "index": 1,
+     "x": 0, "y": 100, "width": 800, "height": 600}    (the size the image was imported at)
+    {"op": "undo"}
+    {"op": "redo"}
+
+Command line, to render a recorded script without a display:
+
+    python doodle_engine.py script.json out.png
+"""
+import math
+
+from PIL import Image, ImageColor
+
+from doodle_brush import Stroke
+from doodle_fill import flood_fill
+from doodle_history import TileHistory
+from doodle_layers import LayerStack
+from doodle_tiles import clip_box, union_box
+from doodle_trace import traced
+
+
+class Change:
+    """A structural edit the undo history replays: a layer "insert", "remove", "move", "visible" or
+    "opacity" change, or a "background" color.  Kept as data rather than a closure so a project
+    can be saved with its history (see doodle_project)."""
+    __slots__ = ("engine", "kind", "layer", "value")
+
+    def __init__(self, engine, kind, layer=None, value=None):
+        self.engine = engine
+        self.kind = kind
+        self.layer = layer
+        self.value = value
+
+    def __call__(self):
+        layers = self.engine.layers
+        if self.kind == "insert":
+            layers.insert(self.value, self.layer)
+        elif self.kind == "remove":
+            layers.remove(self.layer)
+        elif self.kind == "move":
+            layers.move(self.layer, self.value)
+        elif self.kind == "visible":
+            layers.set_visible(self.layer, self.value)
+        elif self.kind == "opacity":
+            layers.set_opacity(self.layer, self.value)
+        elif self.kind == "background":
+            self.engine.background = self.value
+        else:
+            raise ValueError(f"Unknown change: {self.kind!r}")
+
+
+class DoodleEngine:
+    def __init__(self, width=800, height=800, history_budget=32 * 1024 * 1024, tile_size=64):
+        self.width = width
+        self.height = height
+
+        # Tool state, used by operations that are not given explicit values
+        self.current_color = "#000000"
+        self.brush_size = 5  # Pixels across; fractions work too
+        self.brush_hardness = 1.0  # 1 for a crisp (anti-aliased) edge, lower for a softer one
+        self.mode = "brush"  # brush, eraser, fill_shape or bg_fill
+        self.fill_tolerance = 50  # Max summed RGBA difference the Fill Shape tool treats as the same color
+
+        self.layers = LayerStack(width, height, tile_size)
+        self.layers.insert(0, self.layers.new_layer())
+        self.history = TileHistory([self.canvas], byte_budget=history_budget)
+        self.background = None  # Color shown and exported under the layers, None for transparent
+
+        # Stroke in progress
+        self.last_point = None
+        self.stroke_points = []
+        self.stroke_box = None
+        self.stroke = None  # doodle_brush.Stroke, which stamps the dabs
+
+        # Image import in progress: the layer being pasted onto, between begin_import and end_import
+        self.import_layer = None
+
+        # Committed operations are appended here while recording (see start_recording)
+        self.recording = None
+        # Callables given every committed operation as it is recorded, e.g. the autosave journal
+        self.listeners = []
+
+    # Recording and replay
+
+    def start_recording(self):
+        self.recording = []
+
+    def stop_recording(self):
+        """Stop recording and return the operations recorded so far"""
+        operations, self.recording = self.recording or [], None
+        return operations
+
+    def replay(self, operations):
+        """Apply a list of recorded operations in order; returns the union of the boxes they changed"""
+        changed = None
+        for operation in operations:
+            changed = union_box(changed, self.apply(operation))
+        return changed
+
+    def apply(self, operation):
+        """Apply one recorded operation and return the box it changed"""
+        kind = operation["op"]
+        if kind == "stroke":
+            self.mode = operation.get("tool", "brush")
+            self.current_color = operation.get("color", self.current_color)
+            self.brush_size = operation.get("size", self.brush_size)
+            self.brush_hardness = operation.get("hardness", 1.0)
+            points = operation["points"]
+            box = self.begin_stroke(points[0], points[1])
+            box = union_box(box, self.extend_stroke(points[2:]))
+            self.end_stroke()
+            return box
+        if kind == "fill_shape":
+            self.current_color = operation.get("color", self.current_color)
+            self.fill_tolerance = operation.get("tolerance", self.fill_tolerance)
+            return self.fill_shape(operation["x"], operation["y"])
+        if kind == "fill_background":
+            return self.set_background(operation.get("color", self.current_color))
+        if kind == "clear":
+            return self.clear()
+        if kind == "add_layer":
+            self.add_layer(operation.get("name"))
+            return None
+        if kind == "remove_layer":
+            return self.remove_layer(operation["index"])
+        if kind == "move_layer":
+            return self.move_layer(operation["index"], operation["to"])
+        if kind == "layer_visible":
+            return self.set_layer_visible(operation["index"], operation["visible"])
+        if kind == "layer_opacity":
+            return self.set_layer_opacity(operation["index"], operation["opacity"])
+        if kind == "merge_down":
+            return self.merge_down(operation["index"])
+        if kind == "select_layer":
+            self.select_layer(operation["index"])
+            return None
+        if kind == "import_image":
+            from doodle_import import load_image  # Only needed here, so the app starts without it
+            size = (operation["width"], operation["height"])
+            image = load_image(operation["path"], size)
+            if image.size != size:
+                image = image.resize(size, Image.LANCZOS)  # Fitting to its own size can round a pixel off
+            return self.import_image(image, (operation["x"], operation["y"]), operation.get("name"), operation["path"],
+                                     operation.get("index"))
+        if kind == "undo":
+            return self.undo()
+        if kind == "redo":
+            return self.redo()
+        raise ValueError(f"Unknown operation: {kind!r}")
+
+    def _record(self, operation):
+        if self.recording is not None:
+            self.recording.append(operation)
+        for listener in self.listeners:
+            listener(operation)
+
+    # Brush and eraser
+
+    def stroke_fill(self):
+        """Color the current tool paints with; None for the eraser"""
+        return self.current_color if self.mode == "brush" else None
+
+    def stroke_bbox(self, points):
+        """Return the (x0, y0, x1, y1) box touched by a brush stroke through points, clipped to the canvas"""
+        xs = points[0::2]
+        ys = points[1::2]
+        # Half the brush width plus slack for the dabs' anti-aliased edges
+        pad = math.ceil(self.brush_size / 2) + 2
+        return clip_box((min(xs) - pad, min(ys) - pad, max(xs) + pad + 1, max(ys) + pad + 1), self.canvas.size)
+
+    @traced(category="engine")
+    def begin_stroke(self, x, y):
+        """Start a brush/eraser stroke with a dab at (x, y); returns the box drawn"""
+        box = self.stroke_bbox([x, y])
+        self.stroke = Stroke(self.canvas, self.brush_size, self.brush_hardness, self.stroke_fill())
+        self.stroke.stamp([(x, y)])
+
+        self.last_point = (x, y)
+        self.stroke_points = [x, y]
+        self.stroke_box = box
+        return box
+
+    @traced(category="engine")
+    def extend_stroke(self, points):
+        """Continue the stroke through a flat [x, y, x, y, ...] list of points; returns the box drawn"""
+        if self.last_point is None or not points:
+            return None
+        line = list(self.last_point) + list(points)
+        box = self.stroke_bbox(line)
+        # Even off the canvas, so the spacing carries on as in one long call
+        self.stroke.follow(line)
+
+        self.last_point = (line[-2], line[-1])
+        self.stroke_points.extend(points)
+        self.stroke_box = union_box(self.stroke_box, box)
+        return box
+
+    @traced(category="engine")
+    def end_stroke(self):
+        """Finish the stroke and record it for undo; returns the box the whole stroke touched"""
+        if self.last_point is None:
+            return None
+        box = self.stroke_box
+        # Give back tiles that were erased, or only grazed by the stroke's margin
+        self.canvas.prune(self.stroke.coverage)
+        self.commit(box, {"op": "stroke", "tool": self.mode, "color": self.current_color,
+                          "size": self.brush_size, "hardness": self.brush_hardness, "points": self.stroke_points})
+        self.last_point = None
+        self.stroke_points = []
+        self.stroke_box = None
+        self.stroke = None
+        return box
+
+    # Fills and clear
+
+    @traced(category="engine")
+    def fill_shape(self, x, y):
+        """Flood fill the shape containing (x, y) with the current color; returns the filled box or None"""
+        rgba = ImageColor.getrgb(self.current_color)
+        if len(rgba) == 3:
+            rgba = rgba + (255,)
+        canvas = self.canvas
+        if not (0 <= x < canvas.width and 0 <= y < canvas.height):
+            return None
+        # Fill inside a window around the seed's tile, growing it threefold towards any side the fill
+        # reaches, until the fill stays clear of every side that is not the edge of the drawing.  A
+        # region that touches no side of the window cannot continue past it, so the cost follows the
+        # size of the filled area rather than of the drawing.
+        window = clip_box(canvas.tile_box((x // canvas.tile_size, y // canvas.tile_size)), canvas.size)
+        while True:
+            image = canvas.crop(window)
+            box = flood_fill(image, (x - window[0], y - window[1]), rgba, tolerance=self.fill_tolerance)
+            if box is None:
+                break
+            width, height = window[2] - window[0], window[3] - window[1]
+            grown = clip_box((window[0] - (2 * width if box[0] == 0 else 0),
+                              window[1] - (2 * height if box[1] == 0 else 0),
+                              window[2] + (2 * width if box[2] == width else 0),
+                              window[3] + (2 * height if box[3] == height else 0)), canvas.size)
+            if grown == window:
+                break
+            if (grown[2] - grown[0]) * (grown[3] - grown[1]) * 2 > canvas.width * canvas.height:
+                grown = (0, 0) + canvas.size  # Most of the way there; one more try, not two
+            window = grown
+        if box is not None:
+            image = image.crop(box)
+            box = (box[0] + window[0], box[1] + window[1], box[2] + window[0], box[3] + window[1])
+            canvas.paste(image, box)
+            canvas.prune(canvas.painted_keys_in(box))
+            self.commit(box, {"op": "fill_shape", "color": self.current_color, "x": x, "y": y,
+                              "tolerance": self.fill_tolerance})
+        return box
+
+    def fill_background(self):
+        """Put the current color behind everything; returns the changed box"""
+        return self.set_background(self.current_color)
+
+    def set_background(self, color):
+        """Set the background color (None for transparent); returns the changed box, None if it was already set"""
+        previous = self.background
+        if color == previous:
+            return None
+        self.background = color
+        box = (0, 0) + self.canvas.size
+        # No pixels change, so the undo record is just the two colors
+        self.history.commit([], box, Change(self, "background", value=previous), Change(self, "background", value=color))
+        self._record({"op": "fill_background", "color": color})
+        return box
+
+    def clear(self):
+        """Erase every layer and the background (the layers themselves stay); returns the changed box"""
+        canvases = [layer.canvas for layer in self.layers]
+        for canvas in canvases:
+            canvas.clear()
+        background, self.background = self.background, None
+        box = (0, 0) + self.canvas.size
+        self.history.commit(canvases, box, Change(self, "background", value=background),
+                            Change(self, "background", value=None))
+        self._record({"op": "clear"})
+        return box
+
+    # Image import.  An image goes onto a new layer of its own, a band of rows at a time if the caller
+    # wants to show it arriving, and is undone as one action.
+
+    def import_image(self, image, position, name=None, path=None, index=None):
+        """Put an RGBA image on a new layer with its top left corner at position; returns the changed box.
+
+        path is the file the image was loaded from, which replaying the import reads again.
+        """
+        if path is None:
+            raise ValueError("an import needs the path of its image file, so it can be replayed")
+        self.begin_import(name, index)
+        self.import_rows(image, position, 0, image.height)
+        return self.end_import(image, position, path)
+
+    def begin_import(self, name=None, index=None):
+        """Add the empty layer an import is pasted onto (above the active one unless index is given) and
+        make it active.
+
+        Nothing else may draw on that layer, or undo or redo, until end_import().
+        """
+        layer = self.layers.new_layer(name)
+        index = self.layers.active + 1 if index is None else index
+        self.layers.insert(index, layer)
+        self.layers.active = index
+        self.history.track(layer.canvas)
+        self.import_layer = layer
+        return index
+
+    def import_rows(self, image, position, top, bottom):
+        """Paste rows top to bottom of image onto the import layer; returns the box drawn"""
+        canvas = self.import_layer.canvas
+        box = clip_box((position[0], position[1] + top, position[0] + image.width, position[1] + bottom), canvas.size)
+        if box is not None:
+            local = (box[0] - position[0], box[1] - position[1], box[2] - position[0], box[3] - position[1])
+            canvas.paste(image.crop(local), box)
+        return box
+
+    def end_import(self, image, position, path):
+        """Record the finished import for undo; returns the box the whole image covers"""
+        layer, self.import_layer = self.import_layer, None
+        box = clip_box((position[0], position[1], position[0] + image.width, position[1] + image.height),
+                       layer.canvas.size)
+        if box is not None:
+            layer.canvas.prune(layer.canvas.painted_keys_in(box))
+        index = self.layers.index(layer)
+        self.history.commit([layer.canvas], box, Change(self, "remove", layer), Change(self, "insert", layer, index))
+        # The path is only a reference: replaying the operation reads the file again
+        self._record({"op": "import_image", "path": path, "name": layer.name, "index": index,
+                      "x": position[0], "y": position[1], "width": image.width, "height": image.height})
+        if self.layers.active != index:
+            # Another layer was selected while pasting; replaying the import would leave this one selected
+            self._record({"op": "select_layer", "index": self.layers.active})
+        return box
+
+    # Layers.  Structural changes are undoable like drawing; index 0 is the bottom layer.
+
+    @property
+    def canvas(self):
+        """The active layer's canvas, which drawing operations paint on"""
+        return self.layers.active_layer.canvas
+
+    @property
+    def composite(self):
+        """All visible layers flattened into one TiledCanvas, recomposed only where something changed"""
+        return self.layers.flattened()
+
+    def load(self, layers, background=None, active=0):
+        """Replace the whole document with the given layers (bottom first), taking their size;
+        starts a new undo history"""
+        self.layers.replace(layers, active)
+        self.width, self.height = self.layers.size
+        self.background = background
+        self.history.reset([layer.canvas for layer in self.layers])
+
+    def layer_box(self, layer):
+        """Box covering everything drawn on a layer, or None if it is empty"""
+        box = None
+        for key in layer.canvas.tiles:
+            box = union_box(box, layer.canvas.tile_box(key))
+        return box and clip_box(box, layer.canvas.size)
+
+    def add_layer(self, name=None):
+        """Add an empty layer above the active one and make it active; returns its index"""
+        layer = self.layers.new_layer(name)
+        index = self.layers.active + 1 if len(self.layers) else 0
+        self.layers.insert(index, layer)
+        self.layers.active = index
+        self.history.track(layer.canvas)
+        self._commit_layer_change(None, Change(self, "remove", layer), Change(self, "insert", layer, index),
+                                  {"op": "add_layer", "name": layer.name})
+        return index
+
+    def remove_layer(self, index):
+        """Delete a layer (never the last one); returns the box it covered"""
+        if len(self.layers) < 2:
+            return None
+        layer = self.layers[index]
+        self.layers.remove(layer)
+        return self._commit_layer_change(self.layer_box(layer), Change(self, "insert", layer, index),
+                                         Change(self, "remove", layer), {"op": "remove_layer", "index": index})
+
+    def move_layer(self, index, to):
+        """Move a layer to another position in the stack; returns the box it covers"""
+        to = max(0, min(len(self.layers) - 1, to))
+        if to == index:
+            return None
+        layer = self.layers[index]
+        self.layers.move(layer, to)
+        return self._commit_layer_change(self.layer_box(layer), Change(self, "move", layer, index),
+                                         Change(self, "move", layer, to), {"op": "move_layer", "index": index, "to": to})
+
+    def set_layer_visible(self, index, visible):
+        """Show or hide a layer; returns the box it covers"""
+        layer = self.layers[index]
+        if layer.visible == visible:
+            return None
+        self.layers.set_visible(layer, visible)
+        return self._commit_layer_change(self.layer_box(layer), Change(self, "visible", layer, not visible),
+                                         Change(self, "visible", layer, visible),
+                                         {"op": "layer_visible", "index": index, "visible": visible})
+
+    def set_layer_opacity(self, index, opacity):
+        """Set a layer's opacity (0.0 - 1.0); returns the box it covers"""
+        layer = self.layers[index]
+        opacity = max(0.0, min(1.0, opacity))
+        previous = layer.opacity
+        if previous == opacity:
+            return None
+        self.layers.set_opacity(layer, opacity)
+        return self._commit_layer_change(self.layer_box(layer), Change(self, "opacity", layer, previous),
+                                         Change(self, "opacity", layer, opacity),
+                                         {"op": "layer_opacity", "index": index, "opacity": opacity})
+
+    def merge_down(self, index):
+        """Flatten a layer onto the one below it and remove it; returns the changed box"""
+        if index < 1:
+            return None
+        upper, lower = self.layers[index], self.layers[index - 1]
+        box = self.layer_box(upper)
+        self.layers.merge(upper, lower)
+        self.layers.remove(upper)
+        self.history.commit([lower.canvas], box, Change(self, "insert", upper, index), Change(self, "remove", upper))
+        self._record({"op": "merge_down", "index": index})
+        return box
+
+    def select_layer(self, index):
+        """Make the layer at index the one drawing operations paint on"""
+        self.layers.active = max(0, min(len(self.layers) - 1, index))
+        self._record({"op": "select_layer", "index": self.layers.active})
+
+    def _commit_layer_change(self, box, undo_action, redo_action, operation):
+        self.history.commit([], box, undo_action, redo_action)
+        self._record(operation)
+        return box
+
+    # History
+
+    @traced(category="history")
+    def commit(self, box=None, operation=None, canvases=None):
+        """Record the changes since the last commit for undo (on the active layer unless canvases
+        are given), and the operation if recording"""
+        self.history.commit(canvases or [self.canvas], box)
+        if operation is not None:
+            self._record(operation)
+
+    @traced(category="history")
+    def undo(self):
+        """Undo the last action in place; returns the restored box (None if nothing was undone or nothing visible changed)"""
+        if not self.history.can_undo():
+            return None
+        box = self.history.undo()
+        self._record({"op": "undo"})
+        return box
+
+    @traced(category="history")
+    def redo(self):
+        """Redo the last undone action in place; returns the restored box (None if nothing was redone or nothing visible changed)"""
+        if not self.history.can_redo():
+            return None
+        box = self.history.redo()
+        self._record({"op": "redo"})
+        return box
+
+    # Export
+
+    @property
+    def image(self):
+        """All visible layers composed into one RGBA image, without the background (a new image on every access)"""
+        return self.composite.to_image()
+
+    def export(self, file_path, format_type):
+        """Write the drawing, on its background, to file_path as "png", "jpeg" or "ico" """
+        from doodle_export import export_image  # Loaded on first use, to keep startup fast
+        export_image(self.image, file_path, format_type, self.background)
+
+    @traced(category="engine")
+    def is_blank(self):
+        """True while nothing has been done to the document: one empty layer, no background, no history"""
+        if self.history.serial or self.background is not None or len(self.layers) != 1:
+            return False
+        layer = self.layers[0]
+        return layer.visible and layer.opacity == 1.0 and not layer.canvas.painted_keys_in()
+
+    def snapshot(self):
+        """Copy-on-write copy of the drawing, safe to compose and encode on another thread"""
+        composite = self.composite
+        # Work out any composite tiles not looked at yet, so the copy no longer depends on the layers
+        for key in list(composite.tiles):
+            composite.get(key)
+        return composite.copy()
+
+
+def main():
+    import argparse
+    import json
+
+    from doodle_export import format_for_path
+
+    parser = argparse.ArgumentParser(description="Replay a recorded Doodle operation script and export the result")
+    parser.add_argument("script", help="JSON file holding a list of operations")
+    parser.add_argument("output", help="Output image path; the format follows the extension")
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    args = parser.parse_args()
+
+    with open(args.script) as f:
+        operations = json.load(f)
+
+    engine = DoodleEngine(args.width, args.height)
+    engine.replay(operations)
+
+    engine.export(args.output, format_for_path(args.output))
+
+
+if __name__ == "__main__":
+    main()
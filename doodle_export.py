@@ -0,0 +1,180 @@
+"""Image export for Doodle, in the foreground or on a worker pool.
+
+export_image() does the actual encoding.  BackgroundExporter runs it on a
+thread pool so the UI keeps responding while files are being written; the
+UI polls it from the Tk event loop to report progress, since Tk must only
+be touched from the main thread.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from doodle_trace import traced
+
+# Extension and file dialog filter for each export format
+FORMATS = {
+    "png": (".png", [('PNG files', '*.png')]),
+    "jpeg": (".jpg", [('JPEG files', '*.jpg')]),
+    "ico": (".ico", [('Icon files', '*.ico')]),
+    "icon_pngs": (".png", [('PNG files', '*.png')]),  # One <name>-<size>.png per icon size
+}
+
+# Frame sizes written into a .ico, and into an icon PNG set
+ICON_SIZES = (16, 24, 32, 48, 64, 128, 256)
+
+
+class DownsamplePyramid:
+    """Successive 2x box-filtered reductions of a square image, built once and shared by every icon size.
+
+    Each requested size is resampled from the smallest level that is still at
+    least that large, so LANCZOS never has to scan more than twice the pixels
+    of its output instead of the whole source.
+    """
+
+    def __init__(self, image, smallest=16):
+        # Icons are square: centre non-square drawings on a transparent square
+        side = max(image.size)
+        if image.width != image.height:
+            square = Image.new("RGBA", (side, side), (0, 0, 0, 0))
+            square.paste(image, ((side - image.width) // 2, (side - image.height) // 2))
+            image = square
+
+        self.levels = [image]
+        while self.levels[-1].width // 2 >= smallest:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    def level_for(self, size):
+        """Smallest level whose side is at least size (the full image if size is larger)"""
+        for level in reversed(self.levels):
+            if level.width >= size:
+                return level
+        return self.levels[0]
+
+    def resize(self, size):
+        level = self.level_for(size)
+        if level.width == size:
+            return level.copy()
+        return level.resize((size, size), Image.LANCZOS)
+
+
+def icon_images(image, sizes=ICON_SIZES):
+    """Square RGBA frames for each requested size no larger than the drawing, largest first.
+
+    A drawing smaller than every requested size gets one frame of its own size.
+    """
+    sizes = sorted((size for size in set(sizes) if size <= max(image.size)), reverse=True)
+    if not sizes:
+        sizes = [max(image.size)]
+    pyramid = DownsamplePyramid(image, smallest=min(sizes))
+    return [pyramid.resize(size) for size in sizes]
+
+
+def export_icon(image, file_path, sizes=ICON_SIZES):
+    """Write every icon size into one .ico file"""
+    frames = icon_images(image, sizes)
+    frames[0].save(file_path, format="ICO", sizes=[frame.size for frame in frames],
+                   append_images=frames[1:])
+    return file_path
+
+
+def export_icon_pngs(image, file_path, sizes=ICON_SIZES):
+    """Write each icon size as its own PNG, named <base>-<size>.png; returns the paths written"""
+    base = os.path.splitext(file_path)[0]
+    paths = []
+    for frame in icon_images(image, sizes):
+        path = f"{base}-{frame.width}.png"
+        frame.save(path, "PNG")
+        paths.append(path)
+    return paths
+
+
+def format_for_path(file_path):
+    """Guess the export format from a file extension, defaulting to PNG"""
+    extension = os.path.splitext(file_path)[1].lower()
+    return {".jpg": "jpeg", ".jpeg": "jpeg", ".ico": "ico"}.get(extension, "png")
+
+
+@traced(category="export")
+def export_image(image, file_path, format_type, background=None):
+    """Write an RGBA image to file_path as "png", "jpeg", "ico" or "icon_pngs"; returns file_path.
+
+    image may also be a TiledCanvas snapshot, which is composed here so that a
+    background export does the composing on its worker too.  background is the
+    drawing's background color (None keeps it transparent).
+    """
+    if not isinstance(image, Image.Image):
+        image = image.to_image()
+    if format_type == "jpeg":
+        # For JPEG, convert to RGB and fill transparency with the background, or white if there is none
+        rgb_image = Image.new("RGB", image.size, background or (255, 255, 255))
+        rgb_image.paste(image, mask=image.split()[3])
+        rgb_image.save(file_path, "JPEG", quality=95)
+        return file_path
+
+    if background is not None:
+        image = Image.alpha_composite(Image.new("RGBA", image.size, background), image)
+    if format_type == "ico":
+        export_icon(image, file_path)
+    elif format_type == "icon_pngs":
+        export_icon_pngs(image, file_path)
+    else:  # PNG
+        image.save(file_path, "PNG")
+    return file_path
+
+
+class ExportJob:
+    """One snapshot being written to one or more files"""
+
+    def __init__(self, targets, futures):
+        self.targets = targets  # list of (file_path, format_type)
+        self.futures = futures
+
+    def completed(self):
+        return sum(1 for future in self.futures if future.done())
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def errors(self):
+        """(file_path, exception) for every target that failed; only meaningful once done()"""
+        failed = []
+        for (file_path, _), future in zip(self.targets, self.futures):
+            error = future.exception()
+            if error is not None:
+                failed.append((file_path, error))
+        return failed
+
+
+class BackgroundExporter:
+    def __init__(self, max_workers=None):
+        # Pillow releases the GIL while encoding, so threads run exports in parallel
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = []
+
+    def submit(self, image, targets, background=None):
+        """Start writing image, on the background color if given, to every (file_path, format_type)
+        in targets, each on its own worker.
+
+        image must be a snapshot the caller will not modify while the job runs.
+        """
+        futures = [self.executor.submit(export_image, image, file_path, format_type, background)
+                   for file_path, format_type in targets]
+        job = ExportJob(list(targets), futures)
+        self.jobs.append(job)
+        return job
+
+    def pending(self):
+        return [job for job in self.jobs if not job.done()]
+
+    def poll(self):
+        """Remove and return the jobs that have finished since the last poll"""
+        finished = []
+        running = []
+        for job in self.jobs:
+            (finished if job.done() else running).append(job)
+        self.jobs = running
+        return finished
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
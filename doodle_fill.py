@@ -0,0 +1,98 @@
+"""Scanline flood fill for the Fill Shape tool.
+
+The per-pixel work (colour distance and threshold) is done by Pillow in C
+over the whole image, producing a byte mask of "pixels close enough to the
+seed colour".  The connected region is then walked one horizontal span at a
+time with bytes.find/rfind, so Python only runs once per span instead of
+once per pixel.  The result is pasted into the image in place and the
+bounding box of the fill is returned so callers can limit redraw and undo
+to that area.
+
+Colour distance is the sum of absolute channel differences over R, G, B
+and A, like ImageDraw.floodfill's thresh, but measured on premultiplied
+colours: all fully transparent pixels count as the same colour no matter
+what RGB they carry, and partly transparent pixels are compared by how
+they actually look.
+"""
+from PIL import Image, ImageChops, ImageColor, ImageMath
+
+
+def color_distance_mask(image, seed, tolerance):
+    """L-mode mask that is 255 where image is within tolerance of the seed colour (both premultiplied)"""
+    # |pixel - seed| for each channel through a lookup table
+    distances = [band.point([abs(v - value) for v in range(256)]) for band, value in zip(image.split(), seed)]
+    if tolerance < 255:
+        # ImageChops.add clips at 255, which only turns sums already over the tolerance into other such sums
+        total = distances[0]
+        for distance in distances[1:]:
+            total = ImageChops.add(total, distance)
+        return total.point([255 if v <= tolerance else 0 for v in range(256)])
+    # Larger tolerances need the whole sum, up to 4 * 255, so add in 32-bit integers instead
+    bands = dict(zip("rgba", distances))
+    return ImageMath.lambda_eval(lambda args: args["convert"]((args["r"] + args["g"] + args["b"] + args["a"]
+                                                                <= tolerance) * 255, "L"), **bands)
+
+
+def flood_fill(image, xy, color, tolerance=50):
+    """Fill the region connected to xy whose colour is within tolerance of the pixel at xy.
+
+    Works in place on an RGBA image.  Returns the (x0, y0, x1, y1) box that
+    was filled, or None if nothing changed (seed outside the image, or the
+    region already has the fill colour).
+    """
+    width, height = image.size
+    x, y = xy
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    if len(color) == 3:
+        color = tuple(color) + (255,)
+    if image.getpixel((x, y)) == tuple(color):
+        return None
+
+    premultiplied = image.convert("RGBa")
+    seed = premultiplied.getpixel((x, y))
+    # 0xff = still fillable, 0x00 = wall or already filled
+    region = bytearray(color_distance_mask(premultiplied, seed, tolerance).tobytes())
+    filled = bytearray(width * height)
+
+    stack = [(x, y)]
+    while stack:
+        x, y = stack.pop()
+        row = y * width
+        index = row + x
+        if not region[index]:
+            continue
+
+        # Grow the span left and right until a wall or the edge of the row
+        left = max(region.rfind(0, row, index) + 1, row)
+        right = region.find(0, index, row + width)
+        if right < 0:
+            right = row + width
+
+        region[left:right] = bytes(right - left)
+        filled[left:right] = b"\xff" * (right - left)
+
+        # Queue one seed per fillable run directly above and below the span
+        for neighbour in (y - 1, y + 1):
+            if not 0 <= neighbour < height:
+                continue
+            offset = (neighbour - y) * width
+            start, end = left + offset, right + offset
+            while start < end:
+                start = region.find(255, start, end)
+                if start < 0:
+                    break
+                stack.append((start - neighbour * width, neighbour))
+                start = region.find(0, start, end)
+                if start < 0:
+                    break
+
+    mask = Image.frombytes("L", image.size, bytes(filled))
+    box = mask.getbbox()
+    if box is None:
+        return None
+    image.paste(color, box, mask.crop(box))
+    return box
@@ -0,0 +1,207 @@
+"""Undo/redo history for Doodle that stores only the pixels each action changed.
+
+For every canvas it tracks (one per layer) the history keeps a copy-on-write
+copy as of the last commit (see doodle_tiles), which costs no pixels until
+the canvas is drawn on again.  When an action is committed, every tile whose object differs from
+the baseline has changed; for each of those only the rectangle that actually
+differs is recorded, as a pair of (optionally zlib-compressed) before/after
+patches.  Entries live in a deque and the oldest ones are dropped once the
+total size goes over a byte budget.
+"""
+import weakref
+import zlib
+from collections import deque
+
+from PIL import Image, ImageChops
+
+from doodle_tiles import BLANK, clip_box, union_box
+
+
+def difference_mask(a, b):
+    """Single-band image that is non-zero wherever two same-sized RGBA images differ in any channel"""
+    r, g, b_, alpha = ImageChops.difference(a, b).split()
+    return ImageChops.lighter(ImageChops.lighter(r, g), ImageChops.lighter(b_, alpha))
+
+
+class HistoryEntry:
+    """One undoable action: the patches it changed on each canvas, plus optional undo/redo callbacks"""
+    __slots__ = ("steps", "box", "undo_action", "redo_action", "nbytes", "serial")
+
+    def __init__(self, steps, box, undo_action=None, redo_action=None, serial=0):
+        self.steps = steps  # list of (canvas, patches), patches being a list of (box, before bytes, after bytes)
+        self.box = box  # union of all patch boxes and the box the callbacks affect
+        self.undo_action = undo_action  # Called after the before-patches are restored
+        self.redo_action = redo_action  # Called before the after-patches are restored
+        self.nbytes = sum(len(before) + len(after) for _, patches in steps for _, before, after in patches)
+        self.serial = serial  # Increases with every entry the history records, never reused
+
+
+class TileHistory:
+    def __init__(self, canvases=(), byte_budget=32 * 1024 * 1024, compress=True):
+        self.byte_budget = byte_budget  # Combined size of all stored patches
+        self.compress = compress
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.nbytes = 0
+        self.serial = 0  # Serial of the newest entry
+        self.keep_from = None  # Serial of the oldest entry the byte budget may not drop, if any
+        # Canvas -> copy-on-write copy as of its last commit; dropped with the canvas once nothing refers to it
+        self.baselines = weakref.WeakKeyDictionary()
+        self.reset(canvases)
+
+    def reset(self, canvases=()):
+        """Forget all history and use the canvases as they are now as the starting point"""
+        self.baselines.clear()
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.nbytes = 0
+        for canvas in canvases:
+            self.track(canvas)
+
+    def track(self, canvas):
+        """Start recording changes to another canvas (a new layer, say) from its current state"""
+        self.baselines[canvas] = canvas.copy()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def commit(self, canvases, box=None, undo_action=None, redo_action=None):
+        """Record everything that changed on the canvases (one or a list) since their last commit.
+
+        box limits the search to where the action drew; tiles outside it are
+        assumed unchanged.  undo_action and redo_action record changes the
+        patches cannot express, such as adding a layer; box is then also the
+        area they affect.  Returns the box that actually changed, or None if
+        the action did not change anything (no entry is recorded).
+        """
+        if not isinstance(canvases, (list, tuple)):
+            canvases = [canvases]
+        steps = []
+        changed = None
+        for canvas in canvases:
+            patches = self._diff(canvas, box)
+            if patches:
+                steps.append((canvas, patches))
+                for patch_box, _, _ in patches:
+                    changed = union_box(changed, patch_box)
+
+        if undo_action is not None:
+            changed = union_box(changed, box)
+        elif not steps:
+            return None
+
+        self.serial += 1
+        entry = HistoryEntry(steps, changed, undo_action, redo_action, self.serial)
+        self.undo_stack.append(entry)
+        self.nbytes += entry.nbytes
+
+        # A new action makes the redo branch unreachable
+        for dropped in self.redo_stack:
+            self.nbytes -= dropped.nbytes
+        self.redo_stack.clear()
+
+        self._trim()
+        return changed
+
+    def _diff(self, canvas, box):
+        """Patches for every tile of canvas inside box that changed since its last commit"""
+        baseline = self.baselines.get(canvas)
+        if baseline is None or canvas.size != baseline.size or canvas.tile_size != baseline.tile_size:
+            self.track(canvas)
+            return []
+
+        box = clip_box(box or (0, 0) + canvas.size, canvas.size)
+        if box is None:
+            return []
+
+        blank_tile = Image.new("RGBA", (canvas.tile_size, canvas.tile_size), BLANK)
+        patches = []
+        for key in sorted(set(canvas.painted_keys_in(box)) | set(baseline.painted_keys_in(box))):
+            before = baseline.get(key)
+            after = canvas.get(key)
+            if before is after:
+                # Untouched since the last commit: a write would have copied the shared tile
+                continue
+            baseline.set_tile(key, after)
+            if after is not None:
+                canvas.shared.add(key)
+
+            # Tighten the tile to just the pixels that differ
+            before = before or blank_tile
+            after = after or blank_tile
+            tile_box = canvas.tile_box(key)
+            local = difference_mask(after, before).getbbox()
+            patch_box = local and clip_box((tile_box[0] + local[0], tile_box[1] + local[1],
+                                            tile_box[0] + local[2], tile_box[1] + local[3]), canvas.size)
+            if not patch_box:
+                continue
+            local = (patch_box[0] - tile_box[0], patch_box[1] - tile_box[1],
+                     patch_box[2] - tile_box[0], patch_box[3] - tile_box[1])
+            patches.append((patch_box, self._encode(before.crop(local)), self._encode(after.crop(local))))
+        return patches
+
+    def undo(self):
+        """Put the before-pixels of the last action back; returns the restored box or None"""
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        for canvas, patches in entry.steps:
+            self._apply(canvas, patches, after=False)
+        if entry.undo_action is not None:
+            entry.undo_action()
+        self.redo_stack.append(entry)
+        return entry.box
+
+    def redo(self):
+        """Re-apply the last undone action; returns the restored box or None"""
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        if entry.redo_action is not None:
+            entry.redo_action()
+        for canvas, patches in entry.steps:
+            self._apply(canvas, patches, after=True)
+        self.undo_stack.append(entry)
+        return entry.box
+
+    def _apply(self, canvas, patches, after):
+        keys = set()
+        for box, before_data, after_data in patches:
+            pixels = self._decode(after_data if after else before_data, (box[2] - box[0], box[3] - box[1]))
+            canvas.paste(pixels, box[:2])
+            keys.update(canvas.keys_in(box))
+        canvas.prune(keys)
+
+        # The restored state is the new baseline
+        baseline = self.baselines.get(canvas)
+        if baseline is None:
+            self.track(canvas)
+            return
+        for key in keys:
+            tile = canvas.get(key)
+            baseline.set_tile(key, tile)
+            if tile is not None:
+                canvas.shared.add(key)
+
+    def _trim(self):
+        """Drop the oldest undo entries until the history fits the byte budget (always keeps the newest,
+        and every entry from keep_from on)"""
+        while (self.nbytes > self.byte_budget and len(self.undo_stack) > 1
+               and (self.keep_from is None or self.undo_stack[0].serial < self.keep_from)):
+            self.nbytes -= self.undo_stack.popleft().nbytes
+
+    def _encode(self, image):
+        data = image.tobytes()
+        if self.compress:
+            data = zlib.compress(data, 1)
+        return data
+
+    def _decode(self, data, size):
+        # Patches of an opened project are read from the file only now (see doodle_project.Blob)
+        data = bytes(data)
+        if self.compress:
+            data = zlib.decompress(data)
+        return Image.frombytes("RGBA", size, data)
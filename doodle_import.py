@@ -0,0 +1,120 @@
+"""Image import for Doodle: decode straight at canvas resolution, off the Tk thread.
+
+load_image() never holds the full-resolution pixels of a big photo when it
+can avoid it: JPEGs are decoded at 1/2, 1/4 or 1/8 scale with draft(), and
+other formats are cut down with reduce() (integer box averaging) before the
+final high-quality resize.  BackgroundImporter runs it on a worker thread,
+and keeps recent results keyed by path, modification time and target size,
+so importing the same file again is instant.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image
+
+IMPORT_FILETYPES = [("Images", "*.png *.jpg *.jpeg *.gif *.bmp *.webp *.tif *.tiff *.ico"), ("All files", "*.*")]
+
+# EXIF orientation -> transposes that put the image upright
+ORIENTATIONS = {
+    2: [Image.Transpose.FLIP_LEFT_RIGHT],
+    3: [Image.Transpose.ROTATE_180],
+    4: [Image.Transpose.FLIP_TOP_BOTTOM],
+    5: [Image.Transpose.TRANSPOSE],
+    6: [Image.Transpose.ROTATE_270],
+    7: [Image.Transpose.TRANSVERSE],
+    8: [Image.Transpose.ROTATE_90],
+}
+
+
+def fit_size(size, bounds):
+    """Largest size with the aspect ratio of size that fits in bounds, never enlarged"""
+    scale = min(bounds[0] / size[0], bounds[1] / size[1], 1)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def load_image(path, bounds):
+    """Decode the image at path, upright and scaled to fit within bounds, as RGBA"""
+    with Image.open(path) as image:
+        transposes = ORIENTATIONS.get(image.getexif().get(0x0112), [])
+        # Work in the file's own orientation; 90 degree turns swap the bounds
+        turned = any(t in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                           Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270) for t in transposes)
+        target = fit_size(image.size, bounds[::-1] if turned else bounds)
+
+        # JPEG only: let the decoder itself scale down by up to 8x
+        image.draft("RGB", target)
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+        factor = min(image.width // target[0], image.height // target[1])
+        if factor > 1:
+            image = image.reduce(factor)
+        if image.size != target:
+            image = image.resize(target, Image.LANCZOS)
+        for transpose in transposes:
+            image = image.transpose(transpose)
+        return image.convert("RGBA")
+
+
+class ImportCache:
+    """Recently imported images, least recently used dropped first once over a byte budget.
+
+    The images are shared with whoever asked for them and must not be modified.
+    """
+
+    def __init__(self, byte_budget=64 * 1024 * 1024):
+        self.byte_budget = byte_budget
+        self.images = OrderedDict()  # (path, mtime, bounds) -> RGBA image
+        self.nbytes = 0
+        self.lock = threading.Lock()  # Results are added from the worker thread
+
+    @staticmethod
+    def key(path, bounds):
+        path = os.path.abspath(path)
+        return (path, os.stat(path).st_mtime_ns, tuple(bounds))
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = image
+            self.nbytes += image.width * image.height * 4
+            while self.nbytes > self.byte_budget and len(self.images) > 1:
+                _, dropped = self.images.popitem(last=False)
+                self.nbytes -= dropped.width * dropped.height * 4
+
+
+class BackgroundImporter:
+    def __init__(self, cache_budget=64 * 1024 * 1024):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.cache = ImportCache(cache_budget)
+
+    def submit(self, path, bounds):
+        """Start decoding path to fit bounds; returns a Future for the RGBA image.
+
+        A cached result comes back already done.
+        """
+        key = self.cache.key(path, bounds)
+        image = self.cache.get(key)
+        if image is not None:
+            future = Future()
+            future.set_result(image)
+            return future
+        future = self.executor.submit(load_image, path, bounds)
+        future.add_done_callback(lambda done: self._cache_result(key, done))
+        return future
+
+    def _cache_result(self, key, future):
+        if future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,384 @@
+"""Crash-safe autosave for Doodle: an append-only operation journal with checkpoints.
+
+Every operation the engine records (see DoodleEngine.listeners) is appended to
+journal.log as one JSON line, so the cost of saving a stroke is the size of
+the stroke, not of the canvas.  Every so often a checkpoint of the whole
+document is written: the painted tiles of every layer, zlib-compressed, after
+a one-line JSON header.  After a crash, recover() loads the checkpoint and
+replays the operations logged after it.
+
+All file writes happen in order on one worker thread.  The main thread only
+queues operation dicts and, for checkpoints, copy-on-write copies of the
+layer canvases.
+
+Operations carry a sequence number.  A checkpoint records the last one it
+includes, so a crash between writing a checkpoint and truncating the log only
+leaves lines that recovery skips.  An undo or redo that reaches past the
+last checkpoint cannot be replayed from it, so it triggers a new checkpoint.
+So does an image import, whose source file may have changed or gone by the
+time the log is replayed.
+
+Each running Doodle keeps its journal in a directory of its own under
+~/.doodle/autosave and holds an OS lock on the lock file in it, which the
+OS releases if the process dies.  So a journal whose lock can be taken was
+left by a session that is no longer running, and only those are offered
+for recovery; another Doodle that is still open is never mistaken for a
+crash.
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from doodle_layers import Layer
+from doodle_tiles import TiledCanvas, decode_tile, encode_tile
+
+MAGIC = b"DOODLE-CHECKPOINT 1\n"
+LOG_NAME = "journal.log"
+CHECKPOINT_NAME = "checkpoint"
+LOCK_NAME = "lock"
+
+
+def default_directory():
+    return os.path.join(os.path.expanduser("~"), ".doodle", "autosave")
+
+
+def lock_file(path):
+    """Open path and lock it without waiting; returns the open file, or None if another process holds it"""
+    try:
+        f = open(path, "a+b")
+    except OSError:
+        return None
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def last_written(directory):
+    """Modification time of the newest journal file in directory, 0 if it has none"""
+    times = [0]
+    for name in (LOG_NAME, CHECKPOINT_NAME):
+        try:
+            times.append(os.path.getmtime(os.path.join(directory, name)))
+        except OSError:
+            pass
+    return max(times)
+
+
+def write_checkpoint(path, state):
+    """Write a document state (see Journal.state) to path, atomically replacing any previous checkpoint"""
+    header = {key: value for key, value in state.items() if key != "layers"}
+    header["layers"] = []
+    blobs = []
+    for name, visible, opacity, canvas in state["layers"]:
+        tiles = []
+        for key in sorted(canvas.tiles):
+            # A tile still on disk in an open project is copied over without decoding it
+            placeholder = canvas.tiles.get(key)
+            if hasattr(placeholder, "encoded"):
+                data = placeholder.encoded()
+            else:
+                tile = canvas.get(key)
+                if tile is None:
+                    continue
+                data = encode_tile(tile)
+            tiles.append([key[0], key[1], len(data)])
+            blobs.append(data)
+        header["layers"].append({"name": name, "visible": visible, "opacity": opacity, "tiles": tiles})
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        for data in blobs:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_checkpoint(path):
+    """Read a checkpoint back as (header, layers), layers being Layer objects bottom first"""
+    with open(path, "rb") as f:
+        if f.readline() != MAGIC:
+            raise ValueError(f"{path} is not a Doodle checkpoint")
+        header = json.loads(f.readline())
+        size = header["tile_size"]
+        layers = []
+        for info in header["layers"]:
+            canvas = TiledCanvas(header["width"], header["height"], size)
+            for column, row, length in info["tiles"]:
+                canvas.replace_tile((column, row), decode_tile(f.read(length), size))
+            layers.append(Layer(info["name"], canvas, info["visible"], info["opacity"]))
+    return header, layers
+
+
+def read_log(path):
+    """Logged (sequence, operation) pairs; a line cut short by a crash ends the log"""
+    entries = []
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                entries.append((record.pop("seq"), record))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+class Journal:
+    def __init__(self, directory=None, checkpoint_every=200):
+        self.root = directory or default_directory()  # Every running Doodle's journal is a directory in here
+        self.directory = None  # This one's, once claimed
+        self.log_path = None
+        self.checkpoint_path = None
+        self.lock = None  # Open, locked lock file of self.directory
+        self.checkpoint_every = checkpoint_every  # Operations between checkpoints
+        self.engine = None
+        self.sequence = 0  # Of the last operation queued
+        self.since_checkpoint = 0
+        self.barrier = 0  # History serial of the newest entry the last checkpoint includes
+        self.error = None  # Last exception raised by the writer, if any
+
+        self.queue = queue.Queue()
+        self.thread = None
+        self.log_file = None
+
+    # Startup
+
+    def exists(self):
+        """True if a session that is no longer running left something to recover.
+
+        The newest such journal is claimed, so recover() reads it and
+        attach() carries on in it (or clears it, if the drawing was not
+        restored).  Journals of Doodles that are still running are locked
+        and left alone.
+        """
+        if self.directory is not None:
+            return self._recoverable()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return False
+        directories = [os.path.join(self.root, name) for name in names]
+        directories = [directory for directory in directories if os.path.isdir(directory)]
+        spare = None  # An empty journal of an ended session, to carry on in if there is nothing to restore
+        for directory in sorted(directories, key=last_written, reverse=True):
+            lock = lock_file(os.path.join(directory, LOCK_NAME))
+            if lock is None:
+                continue  # A running Doodle's
+            self._claim(directory, lock)
+            if self._recoverable():
+                if spare is not None:
+                    spare[1].close()
+                return True
+            if spare is None:
+                spare = (directory, lock)
+            else:
+                lock.close()
+        if spare is not None:
+            self._claim(*spare)
+        else:
+            self._claim(None, None)
+        return False
+
+    def _recoverable(self):
+        if read_log(self.log_path):
+            return True
+        try:
+            with open(self.checkpoint_path, "rb") as f:
+                return f.readline() == MAGIC and json.loads(f.readline())["sequence"] > 0
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _claim(self, directory, lock):
+        self.directory = directory
+        self.lock = lock
+        self.log_path = directory and os.path.join(directory, LOG_NAME)
+        self.checkpoint_path = directory and os.path.join(directory, CHECKPOINT_NAME)
+
+    def _claim_new(self):
+        os.makedirs(self.root, exist_ok=True)
+        while True:
+            directory = tempfile.mkdtemp(prefix="session-", dir=self.root)
+            lock = lock_file(os.path.join(directory, LOCK_NAME))
+            if lock is not None:
+                self._claim(directory, lock)
+                return
+            # Another Doodle starting up took it as an empty journal to reuse; make another
+
+    def recover(self, engine):
+        """Rebuild the last journaled state into engine: load the checkpoint, then replay the log after it.
+
+        Returns True if anything was restored.  Call before attach().
+        """
+        sequence = 0
+        if os.path.exists(self.checkpoint_path):
+            header, layers = read_checkpoint(self.checkpoint_path)
+            engine.load(layers, header["background"], header["active"])
+            sequence = header["sequence"]
+        restored = sequence > 0
+        for number, operation in read_log(self.log_path):
+            if number > sequence:
+                engine.apply(operation)
+                sequence = number
+                restored = True
+        self.sequence = sequence
+        return restored
+
+    def attach(self, engine):
+        """Start journaling engine's operations, taking its current state as the first checkpoint.
+
+        A blank document needs no checkpoint, since recovery starts from a
+        blank one anyway, so then whatever an earlier session left is only
+        deleted.
+        """
+        if self.directory is None:
+            self._claim_new()
+        self.engine = engine
+        engine.listeners.append(self.append)
+        self.thread = threading.Thread(target=self._run, name="doodle-journal", daemon=True)
+        self.thread.start()
+        if self.sequence == 0 and engine.is_blank():
+            self.queue.put(("reset", None, None))
+        else:
+            self.checkpoint()
+
+    # Main thread side
+
+    def append(self, operation):
+        """Engine listener: queue one committed operation for the log"""
+        self.sequence += 1
+        self.queue.put(("op", self.sequence, operation))
+        self.since_checkpoint += 1
+
+        history = self.engine.history
+        kind = operation["op"]
+        if kind == "undo" and history.redo_stack and history.redo_stack[-1].serial <= self.barrier:
+            self.checkpoint()
+        elif kind == "redo" and history.undo_stack and history.undo_stack[-1].serial <= self.barrier:
+            self.checkpoint()
+        elif kind == "import_image":
+            self.checkpoint()
+        elif self.since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def state(self):
+        """The document as it is now, with copy-on-write layer copies the writer can read safely"""
+        engine = self.engine
+        return {
+            "sequence": self.sequence,
+            "width": engine.width,
+            "height": engine.height,
+            "tile_size": engine.layers.tile_size,
+            "background": engine.background,
+            "active": engine.layers.active,
+            "layers": [(layer.name, layer.visible, layer.opacity, layer.canvas.copy()) for layer in engine.layers],
+        }
+
+    def checkpoint(self):
+        """Queue a checkpoint of the current document"""
+        self.queue.put(("checkpoint", self.sequence, self.state()))
+        self.since_checkpoint = 0
+        self.barrier = self.engine.history.serial
+
+    def close(self, discard=False):
+        """Finish pending writes and stop the writer; discard deletes the journal (a clean exit).
+
+        Either way the journal is unlocked, so a journal that was not
+        discarded is offered for recovery the next time Doodle starts.
+        """
+        if self.engine is not None:
+            self.engine.listeners.remove(self.append)
+            self.engine = None
+        if self.thread is not None:
+            self.queue.put(("close", discard, None))
+            self.thread.join()
+            self.thread = None
+        elif discard and self.directory is not None:
+            self._discard()
+        if self.lock is not None:
+            if discard:
+                self._remove_directory()
+            else:
+                self.lock.close()
+            self._claim(None, None)
+
+    # Worker thread side
+
+    def _run(self):
+        while True:
+            kind, value, payload = self.queue.get()
+            try:
+                if kind == "op":
+                    self._write_operation(value, payload)
+                elif kind == "checkpoint":
+                    write_checkpoint(self.checkpoint_path, payload)
+                    # Everything logged so far is in the checkpoint now
+                    self._close_log()
+                    self.log_file = open(self.log_path, "wb")
+                elif kind == "reset":
+                    self._close_log()
+                    self._discard()
+                elif kind == "close":
+                    self._close_log()
+                    if value:
+                        self._discard()
+                    return
+            except Exception as e:
+                self.error = e
+                print("Autosave failed:", e)
+
+    def _write_operation(self, sequence, operation):
+        if self.log_file is None:
+            self.log_file = open(self.log_path, "ab")
+        record = dict(operation, seq=sequence)
+        self.log_file.write(json.dumps(record).encode("utf-8") + b"\n")
+        self.log_file.flush()
+        # Only sync when the writer has caught up, so a burst of operations costs one sync
+        if self.queue.empty():
+            os.fsync(self.log_file.fileno())
+
+    def _close_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def _discard(self):
+        for path in (self.log_path, self.checkpoint_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _remove_directory(self):
+        # The lock file goes while still locked where the OS allows it (not on Windows), so no
+        # other Doodle can take the directory between unlocking and removing it
+        lock_path = os.path.join(self.directory, LOCK_NAME)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+        self.lock.close()
+        for remove, path in ((os.remove, lock_path), (os.rmdir, self.directory)):
+            try:
+                remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,176 @@
+"""Layer stack for Doodle with a cached, incrementally updated composite.
+
+Every layer is its own TiledCanvas.  The flattened result is kept in another
+TiledCanvas and only the tiles that changed are recomposed: each canvas
+records the tiles it touches in its dirty set, and layer property changes
+(visibility, opacity, order) mark just the tiles that layer has painted.
+Compositing therefore costs time in proportion to the changed area, not to
+the number of layers times the canvas size.  A recomposed tile is only
+worked out when it is first read (see the placeholders in doodle_tiles), so
+tiles nobody looks at, such as most of a large project just opened, cost
+nothing.
+"""
+from PIL import Image
+
+from doodle_tiles import TiledCanvas
+
+
+class Layer:
+    def __init__(self, name, canvas, visible=True, opacity=1.0):
+        self.name = name
+        self.canvas = canvas
+        self.visible = visible
+        self.opacity = opacity  # 0.0 - 1.0, applied on top of the pixels' own alpha
+
+
+def with_opacity(tile, opacity):
+    """Copy of an RGBA tile with its alpha scaled by opacity"""
+    faded = tile.copy()
+    faded.putalpha(tile.getchannel("A").point([round(a * opacity) for a in range(256)]))
+    return faded
+
+
+class Recompose:
+    """Composite tile placeholder: flattens the layers at key when the tile is read"""
+    __slots__ = ("stack", "key")
+
+    def __init__(self, stack, key):
+        self.stack = stack
+        self.key = key
+
+    def resolve(self):
+        return self.stack.compose_tile(self.key)
+
+
+class LayerStack:
+    def __init__(self, width, height, tile_size=64):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.layers = []  # Bottom to top
+        self.active = 0  # Index of the layer that drawing operations target
+        self.composite = TiledCanvas(width, height, tile_size)
+        self.stale = set()  # Composite tiles to recompose besides those in the layers' dirty sets
+        self.counter = 0  # For default layer names
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __getitem__(self, index):
+        return self.layers[index]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def index(self, layer):
+        return self.layers.index(layer)
+
+    @property
+    def active_layer(self):
+        return self.layers[self.active]
+
+    def new_layer(self, name=None):
+        """Make an empty layer without adding it to the stack"""
+        self.counter += 1
+        return Layer(name or f"Layer {self.counter}", TiledCanvas(self.width, self.height, self.tile_size))
+
+    # Structure.  Each of these marks only the tiles the affected layer has painted.
+
+    def insert(self, index, layer):
+        self.layers.insert(index, layer)
+        self._mark(layer)
+        if index <= self.active and len(self.layers) > 1:
+            self.active += 1
+
+    def remove(self, layer):
+        """Take a layer out of the stack"""
+        index = self.layers.index(layer)
+        del self.layers[index]
+        self._mark(layer)
+        if self.active > index or self.active >= len(self.layers):
+            self.active = max(0, self.active - 1)
+
+    def replace(self, layers, active=0):
+        """Swap in a whole new list of layers, bottom first; the canvas takes their size"""
+        for layer in self.layers + list(layers):
+            self._mark(layer)
+        canvas = layers[0].canvas
+        if (canvas.width, canvas.height, canvas.tile_size) != (self.width, self.height, self.tile_size):
+            self.width, self.height, self.tile_size = canvas.width, canvas.height, canvas.tile_size
+            self.composite.clear()
+            self.composite.width, self.composite.height = self.width, self.height
+            self.composite.tile_size = self.tile_size
+        self.layers = list(layers)
+        self.active = active
+        self.counter = max(self.counter, len(self.layers))
+
+    def move(self, layer, index):
+        active_layer = self.active_layer
+        self.layers.remove(layer)
+        self.layers.insert(index, layer)
+        self.active = self.layers.index(active_layer)
+        self._mark(layer)
+
+    def set_visible(self, layer, visible):
+        if layer.visible != visible:
+            layer.visible = visible
+            self._mark(layer)
+
+    def set_opacity(self, layer, opacity):
+        if layer.opacity != opacity:
+            layer.opacity = opacity
+            self._mark(layer)
+
+    def _mark(self, layer):
+        """Recompose every tile the layer has painted (or touched since the last flattened())"""
+        self.stale.update(layer.canvas.tiles)
+        self.stale.update(layer.canvas.dirty)
+
+    # Composition
+
+    def flattened(self):
+        """The composite of all visible layers, brought up to date first"""
+        for layer in self.layers:
+            self.stale.update(layer.canvas.dirty)
+            layer.canvas.dirty.clear()
+        for key in self.stale:
+            self.composite.set_placeholder(key, Recompose(self, key))
+        self.stale.clear()
+        self.composite.dirty.clear()
+        return self.composite
+
+    def compose_tile(self, key, layers=None):
+        """Flatten one tile position over the given layers (all of them by default); None if blank"""
+        result = None
+        for layer in self.layers if layers is None else layers:
+            tile = layer.canvas.get(key)
+            if tile is None or not layer.visible or layer.opacity <= 0:
+                continue
+            if layer.opacity < 1:
+                tile = with_opacity(tile, layer.opacity)
+            elif result is None:
+                # Share the layer's tile; writing to it will now copy it first
+                layer.canvas.shared.add(key)
+                result = tile
+                continue
+            result = tile if result is None else Image.alpha_composite(result, tile)
+        return result
+
+    def merge(self, upper, lower):
+        """Flatten upper onto lower (upper's visibility and opacity apply); upper stays in the stack"""
+        for key in list(upper.canvas.tiles):
+            merged = self.compose_tile(key, [
+                Layer(lower.name, lower.canvas),
+                Layer(upper.name, upper.canvas, upper.visible, upper.opacity),
+            ])
+            if merged is lower.canvas.get(key):
+                continue
+            if merged is upper.canvas.get(key):
+                lower.canvas.set_tile(key, merged)
+                upper.canvas.shared.add(key)
+            else:
+                lower.canvas.replace_tile(key, merged)
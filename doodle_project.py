@@ -0,0 +1,282 @@
+"""Native .doodle project files: layers as compressed tiles, the undo history and document settings.
+
+Layout:
+
+    MAGIC
+    index offset, index length   (two little-endian uint64, rewritten in place on every save)
+    blobs ...                    (zlib-compressed tiles and undo patches)
+    index                        (zlib-compressed JSON describing the document and where each blob is)
+
+Opening maps the file into memory and reads only the index.  Every tile goes
+into its canvas as a placeholder (see doodle_tiles) and is decoded the first
+time it is read, so the first repaint decodes just the tiles on screen and
+opening takes about the same time whatever the size of the project.  Undo
+patches stay on disk until they are undone or redone.
+
+Saving appends only tiles and patches the file does not already hold, then a
+new index, and finally points the header at it; until that last write the
+previous index stays valid, so an interrupted save loses nothing.  Once more
+than half of the file is unreferenced it is rewritten from scratch.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+from doodle_engine import Change
+from doodle_history import HistoryEntry
+from doodle_layers import Layer
+from doodle_tiles import TiledCanvas, decode_tile, encode_tile
+
+MAGIC = b"DOODLE-PROJECT 1\n"
+POINTER = struct.Struct("<QQ")  # Index offset and length, right after MAGIC
+PROJECT_EXTENSION = ".doodle"
+PROJECT_FILETYPES = [("Doodle project", "*.doodle")]
+
+
+class ProjectFile:
+    """Read-only memory map of a project file as it was when opened or last rewritten"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a Doodle project")
+        # id(object) -> (object, offset, length) for every tile, placeholder and patch stored in this file
+        self.locations = {}
+
+    def read(self, offset, length):
+        return self.map[offset:offset + length]
+
+    def index(self):
+        offset, length = POINTER.unpack_from(self.map, len(MAGIC))
+        return json.loads(zlib.decompress(self.read(offset, length)))
+
+
+class FileTile:
+    """Tile placeholder that decodes the tile from a project file when it is first read"""
+    __slots__ = ("source", "offset", "length", "size", "image")
+
+    def __init__(self, source, offset, length, size):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.size = size
+        self.image = None  # Decoded once, shared by every canvas copy holding this placeholder
+
+    def resolve(self):
+        if self.image is None:
+            self.image = decode_tile(self.encoded(), self.size)
+            # The decoded tile is still the one on disk until somebody draws on it (which copies it)
+            self.source.locations[id(self.image)] = (self.image, self.offset, self.length)
+        return self.image
+
+    def encoded(self):
+        """The tile's compressed bytes, without decoding them"""
+        return self.source.read(self.offset, self.length)
+
+
+class Blob:
+    """Undo patch data still in a project file; bytes() reads it"""
+    __slots__ = ("source", "offset", "length")
+
+    def __init__(self, source, offset, length):
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __bytes__(self):
+        return self.source.read(self.offset, self.length)
+
+
+class Project:
+    """A document bound to a .doodle file; save() writes only what changed since the last save or open"""
+
+    def __init__(self, path, source=None):
+        self.path = path
+        self.source = source  # ProjectFile for path, None until the first save
+
+    def save(self, engine, path=None):
+        """Write engine's document and undo history to the project file (or to path, which becomes the
+        project file from then on)"""
+        if path is not None and os.path.abspath(path) != os.path.abspath(self.path):
+            self.path = path
+            self.source = None
+
+        if self.source is not None:
+            written, live = self._write(engine, self.path, append=True)
+            self.source.locations = written
+            if os.path.getsize(self.path) <= 2 * live:
+                return
+            # Over half of the file is no longer referenced: rewrite it
+
+        temp_path = self.path + ".tmp"
+        written, _ = self._write(engine, temp_path, append=False)
+        try:
+            os.replace(temp_path, self.path)
+        except PermissionError:
+            # The file is still mapped (Windows), so it cannot be replaced; it just stays larger
+            os.remove(temp_path)
+            if self.source is None:
+                raise
+            return
+        self.source = ProjectFile(self.path)
+        self.source.locations = written
+        # Read anything not loaded yet from the new file, so the old one can be unmapped
+        for obj, offset, length in written.values():
+            if isinstance(obj, (FileTile, Blob)):
+                obj.source, obj.offset, obj.length = self.source, offset, length
+
+    def _write(self, engine, path, append):
+        """Write every tile and patch the file at path lacks, then a new index.
+
+        Returns the locations of everything the index refers to and their total size in bytes.
+        """
+        layers, layer_of = collect(engine)
+        known = self.source.locations if append else {}
+        written = {}  # id(object) -> (object, offset, length)
+        live = 0
+
+        with open(path, "r+b" if append else "wb") as f:
+            if append:
+                f.seek(0, os.SEEK_END)
+            else:
+                f.write(MAGIC + POINTER.pack(0, 0))
+
+            def store(obj, encode):
+                """File location [offset, length] of obj, writing it first if the file does not hold it yet"""
+                nonlocal live
+                location = written.get(id(obj)) or known.get(id(obj))
+                if location is not None and location[0] is obj:
+                    location = location[1:]
+                elif append and isinstance(obj, (FileTile, Blob)) and obj.source is self.source:
+                    location = (obj.offset, obj.length)
+                else:
+                    data = encode()
+                    location = (f.tell(), len(data))
+                    f.write(data)
+                written[id(obj)] = (obj,) + location
+                live += location[1]
+                return list(location)
+
+            number_of = {id(layer): number for number, layer in enumerate(layers)}
+            history = engine.history
+            index = {
+                "width": engine.width,
+                "height": engine.height,
+                "tile_size": engine.layers.tile_size,
+                "background": engine.background,
+                "active": engine.layers.active,
+                "counter": engine.layers.counter,
+                "stack": [number_of[id(layer)] for layer in engine.layers],
+                "layers": [],
+                "history": {"serial": history.serial, "undo": [], "redo": []},
+            }
+
+            for layer in layers:
+                tiles = []
+                for key in sorted(layer.canvas.tiles):
+                    tile = layer.canvas.tiles[key]
+                    if isinstance(tile, FileTile):
+                        tiles.append(list(key) + store(tile, tile.encoded))
+                    else:
+                        tiles.append(list(key) + store(tile, lambda tile=tile: encode_tile(tile)))
+                index["layers"].append({"name": layer.name, "visible": layer.visible,
+                                        "opacity": layer.opacity, "tiles": tiles})
+
+            for name, stack in (("undo", history.undo_stack), ("redo", history.redo_stack)):
+                for entry in stack:
+                    steps = []
+                    for canvas, patches in entry.steps:
+                        layer = layer_of.get(id(canvas))
+                        if layer is None:
+                            continue
+                        steps.append([number_of[id(layer)], [
+                            list(box) + store(before, lambda data=before: bytes(data))
+                            + store(after, lambda data=after: bytes(data))
+                            for box, before, after in patches]])
+                    index["history"][name].append({
+                        "serial": entry.serial,
+                        "box": entry.box,
+                        "steps": steps,
+                        "undo": save_change(entry.undo_action, number_of),
+                        "redo": save_change(entry.redo_action, number_of),
+                    })
+
+            data = zlib.compress(json.dumps(index).encode("utf-8"))
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            # Only now does the file switch over to the new index
+            f.seek(len(MAGIC))
+            f.write(POINTER.pack(offset, len(data)))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # A saved tile must not be drawn on in place, or the next save would take it for the one on disk
+        for layer in layers:
+            layer.canvas.shared.update(layer.canvas.tiles)
+        return written, live + len(MAGIC) + POINTER.size + len(data)
+
+
+def collect(engine):
+    """Every layer the document or its undo history refers to (stack first), and canvas id -> layer"""
+    layers = list(engine.layers)
+    for entry in list(engine.history.undo_stack) + list(engine.history.redo_stack):
+        for change in (entry.undo_action, entry.redo_action):
+            if isinstance(change, Change) and change.layer is not None and change.layer not in layers:
+                layers.append(change.layer)
+    return layers, {id(layer.canvas): layer for layer in layers}
+
+
+def save_change(change, number_of):
+    if change is None:
+        return None
+    return {"kind": change.kind, "layer": None if change.layer is None else number_of[id(change.layer)],
+            "value": change.value}
+
+
+def open_project(path, engine):
+    """Load a .doodle file into engine, including its undo history; returns the Project to save it with"""
+    source = ProjectFile(path)
+    index = source.index()
+    size = index["tile_size"]
+
+    layers = []
+    for info in index["layers"]:
+        canvas = TiledCanvas(index["width"], index["height"], size)
+        for column, row, offset, length in info["tiles"]:
+            canvas.set_placeholder((column, row), FileTile(source, offset, length, size))
+        layers.append(Layer(info["name"], canvas, info["visible"], info["opacity"]))
+
+    engine.load([layers[number] for number in index["stack"]], index["background"], index["active"])
+    engine.layers.counter = max(engine.layers.counter, index["counter"])
+
+    history = engine.history
+    for layer in layers:
+        if layer.canvas not in history.baselines:
+            history.track(layer.canvas)
+
+    def load_change(data):
+        if data is None:
+            return None
+        return Change(engine, data["kind"], None if data["layer"] is None else layers[data["layer"]], data["value"])
+
+    for stack_name, stack in (("undo", history.undo_stack), ("redo", history.redo_stack)):
+        for data in index["history"][stack_name]:
+            steps = [(layers[number].canvas,
+                      [(tuple(patch[:4]), Blob(source, patch[4], patch[5]), Blob(source, patch[6], patch[7]))
+                       for patch in patches])
+                     for number, patches in data["steps"]]
+            box = tuple(data["box"]) if data["box"] is not None else None
+            entry = HistoryEntry(steps, box, load_change(data["undo"]), load_change(data["redo"]), data["serial"])
+            stack.append(entry)
+            history.nbytes += entry.nbytes
+    history.serial = index["history"]["serial"]
+    return Project(path, source)
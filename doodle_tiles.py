@@ -0,0 +1,224 @@
+"""Sparse tiled backing store for the Doodle canvas.
+
+The drawing is split into fixed-size square tiles that are only allocated
+when something is drawn on them; a missing tile is fully transparent.  Memory
+and the cost of drawing, composing and diffing therefore follow the painted
+area instead of the canvas dimensions.
+
+copy() shares tile objects between the original and the copy, and a shared
+tile is copied the first time either side writes to it (copy-on-write).  The
+undo history uses this to keep its baseline without duplicating pixels, and
+an unchanged tile keeps its identity, so "did this tile change?" is a
+pointer comparison.
+
+A tile may also be held as a placeholder, an object with a resolve() method
+that produces the tile (or None) the first time it is read.  Projects use
+this to decode tiles from disk only when they are needed, and the layer stack
+to recompose only the composite tiles somebody looks at.
+"""
+import zlib
+
+from PIL import Image
+
+BLANK = (255, 255, 255, 0)
+
+# Number of 2x mip levels above the tiles whose revisions are tracked (see TiledCanvas.touch)
+MIP_LEVELS = 8
+
+
+def encode_tile(tile):
+    """Compressed bytes of an RGBA tile, as stored in checkpoints and project files"""
+    return zlib.compress(tile.tobytes(), 1)
+
+
+def decode_tile(data, size):
+    return Image.frombytes("RGBA", (size, size), zlib.decompress(data))
+
+
+def intersect_box(a, b):
+    """Overlap of two (x0, y0, x1, y1) boxes, or None if they do not overlap"""
+    x0 = max(a[0], b[0])
+    y0 = max(a[1], b[1])
+    x1 = min(a[2], b[2])
+    y1 = min(a[3], b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def clip_box(box, size):
+    """Clip a box to an image of the given size, or return None if nothing is left"""
+    return intersect_box(box, (0, 0) + tuple(size))
+
+
+def union_box(a, b):
+    """Smallest box covering both a and b; either may be None"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+class TiledCanvas:
+    def __init__(self, width, height, tile_size=64):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.tiles = {}  # (column, row) -> RGBA tile image, or a placeholder that resolves to one
+        self.shared = set()  # Keys whose tile is also referenced elsewhere and must be copied before writing
+        self.revisions = {}  # key -> counter bumped whenever that tile may have changed, for display caches
+        self.region_revisions = {}  # (level, column >> level, row >> level) -> latest revision inside that block
+        self.revision = 0
+        self.dirty = set()  # Keys touched since the owner last emptied this set (see doodle_layers)
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def nbytes(self):
+        """Memory held by allocated tiles"""
+        return len(self.tiles) * self.tile_size * self.tile_size * 4
+
+    # Tile lookup
+
+    def tile_box(self, key):
+        size = self.tile_size
+        return (key[0] * size, key[1] * size, (key[0] + 1) * size, (key[1] + 1) * size)
+
+    def keys_in(self, box):
+        """Every tile position overlapping box, allocated or not"""
+        box = clip_box(box, self.size)
+        if box is None:
+            return []
+        size = self.tile_size
+        return [(column, row)
+                for row in range(box[1] // size, (box[3] - 1) // size + 1)
+                for column in range(box[0] // size, (box[2] - 1) // size + 1)]
+
+    def painted_keys_in(self, box=None):
+        """Allocated tiles overlapping box (all of them when box is None)"""
+        if box is None:
+            return list(self.tiles)
+        box = clip_box(box, self.size)
+        if box is None:
+            return []
+        size = self.tile_size
+        first_column, first_row = box[0] // size, box[1] // size
+        last_column, last_row = (box[2] - 1) // size, (box[3] - 1) // size
+        return [key for key in self.tiles
+                if first_column <= key[0] <= last_column and first_row <= key[1] <= last_row]
+
+    def get(self, key):
+        """Tile at key for reading, or None if it is blank"""
+        tile = self.tiles.get(key)
+        if tile is None or isinstance(tile, Image.Image):
+            return tile
+        # A placeholder: produce the tile now and keep it
+        tile = tile.resolve()
+        if tile is None:
+            self.tiles.pop(key, None)
+            self.shared.discard(key)
+        else:
+            self.tiles[key] = tile
+        return tile
+
+    def set_placeholder(self, key, placeholder):
+        """Install a tile that will only be produced, by placeholder.resolve(), when it is first read"""
+        self.touch(key)
+        self.tiles[key] = placeholder
+        self.shared.add(key)
+
+    def touch(self, key):
+        """Note that the tile at key has (or may have) changed"""
+        self.revision += 1
+        self.revisions[key] = self.revision
+        self.dirty.add(key)
+        for level in range(1, MIP_LEVELS + 1):
+            self.region_revisions[(level, key[0] >> level, key[1] >> level)] = self.revision
+
+    def writable(self, key):
+        """Tile at key for writing: allocated if blank, copied first if shared"""
+        self.touch(key)
+        tile = self.get(key)
+        if tile is None:
+            tile = Image.new("RGBA", (self.tile_size, self.tile_size), BLANK)
+            self.tiles[key] = tile
+        elif key in self.shared:
+            tile = tile.copy()
+            self.tiles[key] = tile
+            self.shared.discard(key)
+        return tile
+
+    def set_tile(self, key, tile):
+        """Install a tile that is referenced elsewhere (None makes the tile blank)"""
+        self.touch(key)
+        if tile is None:
+            self.tiles.pop(key, None)
+            self.shared.discard(key)
+        else:
+            self.tiles[key] = tile
+            self.shared.add(key)
+
+    def replace_tile(self, key, tile):
+        """Install a new tile that nothing else references"""
+        self.touch(key)
+        self.tiles[key] = tile
+        self.shared.discard(key)
+
+    def copy(self):
+        """Copy-on-write copy: no pixels are duplicated until one side writes to a tile"""
+        other = TiledCanvas(self.width, self.height, self.tile_size)
+        other.tiles = dict(self.tiles)
+        other.shared = set(self.tiles)
+        self.shared = set(self.tiles)
+        return other
+
+    def clear(self):
+        for key in self.tiles:
+            self.touch(key)
+        self.tiles = {}
+        self.shared = set()
+
+    # Drawing
+
+    def paste(self, source, box, mask=None):
+        """Like Image.paste(source, box, mask) on the full canvas; source is an image or a color"""
+        box = tuple(box)
+        if len(box) == 2:
+            box = box + (box[0] + source.width, box[1] + source.height)
+        for key in self.keys_in(box):
+            tile_box = self.tile_box(key)
+            part = intersect_box(tile_box, box)
+            local = (part[0] - box[0], part[1] - box[1], part[2] - box[0], part[3] - box[1])
+            piece = source.crop(local) if isinstance(source, Image.Image) else source
+            target = (part[0] - tile_box[0], part[1] - tile_box[1], part[2] - tile_box[0], part[3] - tile_box[1])
+            self.writable(key).paste(piece, target, mask.crop(local) if mask is not None else None)
+
+    def prune(self, keys):
+        """Free the tiles at keys that are (or have become) fully transparent"""
+        for key in keys:
+            tile = self.get(key)
+            if tile is not None and tile.getchannel("A").getbbox() is None:
+                self.set_tile(key, None)
+
+    # Composition
+
+    def crop(self, box):
+        """Compose the pixels inside box into a new RGBA image"""
+        box = tuple(box)
+        image = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), BLANK)
+        for key in self.painted_keys_in(box):
+            tile = self.get(key)
+            if tile is None:
+                continue
+            tile_box = self.tile_box(key)
+            part = intersect_box(tile_box, box)
+            image.paste(tile.crop((part[0] - tile_box[0], part[1] - tile_box[1],
+                                   part[2] - tile_box[0], part[3] - tile_box[1])),
+                        (part[0] - box[0], part[1] - box[1]))
+        return image
+
+    def to_image(self):
+        """Compose the whole canvas into one RGBA image"""
+        return self.crop((0, 0, self.width, self.height))
@@ -0,0 +1,188 @@
+"""Opt-in performance instrumentation for Doodle.
+
+Handlers and engine operations are decorated with @traced and the phases
+inside a repaint are wrapped in tracer.span(...).  While tracing is off
+(the default) a decorated call costs one flag check and span() hands back
+a shared do-nothing context manager, so the instrumentation can stay in
+the code.
+
+While tracing is on, every call and phase is kept as a Chrome trace event
+("complete" events with start and duration in microseconds, one track per
+thread) and dump() writes them out for chrome://tracing or
+https://ui.perfetto.dev.  Repaints are also counted as frames, which gives
+the live frame time and FPS readout, and handler calls give events per
+second.
+
+StartupProfile is separate from the tracer: it times the phases of one
+startup for doodle.py --profile-startup.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "category", "start")
+
+    def __init__(self, tracer, name, category):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter_ns())
+        return False
+
+
+class Tracer:
+    def __init__(self, max_events=500000):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)  # Oldest dropped first on a very long session
+        self.frames = deque(maxlen=600)  # (end, duration) in ns of recent repaints
+        self.handled = deque(maxlen=10000)  # End times in ns of recent handler calls
+        self.origin = time.perf_counter_ns()
+        self.threads = {}  # Thread id -> name, for the trace's thread tracks
+
+    def start(self):
+        """Start collecting, dropping anything from an earlier session"""
+        self.events.clear()
+        self.frames.clear()
+        self.handled.clear()
+        self.origin = time.perf_counter_ns()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, category="phase"):
+        """Context manager timing the block inside it, when tracing is on"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category)
+
+    def record(self, name, category, start, end):
+        """Add a complete event; start and end are time.perf_counter_ns() readings"""
+        thread = threading.get_ident()
+        if thread not in self.threads:
+            self.threads[thread] = threading.current_thread().name
+        self.events.append({"name": name, "cat": category, "ph": "X", "ts": (start - self.origin) / 1000,
+                            "dur": (end - start) / 1000, "pid": os.getpid(), "tid": thread})
+        if category == "frame":
+            self.frames.append((end, end - start))
+        elif category == "handler":
+            self.handled.append(end)
+
+    def counter(self, name, **values):
+        """Add a counter sample (shown as a graph in the trace viewer)"""
+        if self.enabled:
+            self.events.append({"name": name, "ph": "C", "ts": (time.perf_counter_ns() - self.origin) / 1000,
+                                "pid": os.getpid(), "args": values})
+
+    # Live readout
+
+    def frame_stats(self, window=1.0):
+        """(frames per second, mean frame ms, slowest frame ms) over the last window seconds"""
+        since = time.perf_counter_ns() - int(window * 1e9)
+        durations = [duration for end, duration in self.frames if end >= since]
+        if not durations:
+            return 0.0, 0.0, 0.0
+        return len(durations) / window, sum(durations) / len(durations) / 1e6, max(durations) / 1e6
+
+    def events_per_second(self, window=1.0):
+        since = time.perf_counter_ns() - int(window * 1e9)
+        return sum(1 for end in self.handled if end >= since) / window
+
+    # Output
+
+    def dump(self, path):
+        """Write the collected events as a Chrome trace JSON file; returns path"""
+        pid = os.getpid()
+        metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "Doodle"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+                     for thread, name in list(self.threads.items())]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}, f)
+        return path
+
+
+tracer = Tracer()
+
+
+def traced(function=None, *, category="handler"):
+    """Decorator timing every call of a function or method while tracing is on"""
+    def decorate(function):
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.record(name, category, start, time.perf_counter_ns())
+        return wrapper
+
+    return decorate if function is None else decorate(function)
+
+
+class StartupProfile:
+    """Wall-clock time of each phase of startup, for --profile-startup"""
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start  # A time.perf_counter() reading
+        self.last = self.start
+        self.phases = []  # (name, seconds) in order
+
+    def mark(self, phase):
+        """End phase now; it started where the previous one ended"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def elapsed(self, phase):
+        """Seconds from the start to the end of phase"""
+        total = 0.0
+        for name, seconds in self.phases:
+            total += seconds
+            if name == phase:
+                return total
+        raise KeyError(phase)
+
+    def report(self, budget=None, budget_phase=None):
+        """The phases as text, checking the time to the end of budget_phase (or in total) against budget"""
+        lines = [f"{name:<24}{seconds * 1000:8.1f} ms" for name, seconds in self.phases]
+        lines.append(f"{'total':<24}{(self.last - self.start) * 1000:8.1f} ms")
+        if budget is not None:
+            label = f"to {budget_phase}" if budget_phase else "in total"
+            taken = self.elapsed(budget_phase) if budget_phase else self.last - self.start
+            verdict = "within" if taken <= budget else "OVER"
+            lines.append(f"{taken * 1000:.1f} ms {label}, {verdict} the {budget * 1000:.0f} ms budget")
+        return "\n".join(lines)
+
+
+def default_trace_path():
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(os.path.expanduser("~"), ".doodle", "traces", f"doodle-trace-{stamp}.json")
@@ -0,0 +1,187 @@
+"""Zoom and pan for the Doodle canvas.
+
+A Viewport maps between view (widget) coordinates and drawing coordinates
+and renders only what is visible, at the displayed scale.  When zoomed out
+it samples from a mip level of the tiled canvas, so the work per repaint
+follows the size of the view rather than the size of the drawing.  Each mip
+level is made of tile-sized blocks, each built from the 2x2 blocks below it
+and cached until a tile inside it changes.
+
+Rendering part of the view gives exactly the pixels a render of the whole
+view has there, so a repaint of a changed region never leaves a seam.  For
+that, the view is rendered in fixed SQUARE x SQUARE pieces, each always
+computed the same way whichever render it is part of, and each piece's
+source is padded past the filter's reach so the pieces join up without
+seams.
+"""
+import math
+
+from PIL import Image
+
+from doodle_tiles import BLANK, MIP_LEVELS, intersect_box
+
+OUTSIDE = (51, 51, 51, 255)  # Window background, shown around the drawing when it does not fill the view
+SQUARE = 128  # View pixels across the squares a scaled render is made of
+
+
+def under(image, background):
+    """image composed over a solid background color, or image itself if background is None"""
+    if background is None:
+        return image
+    return Image.alpha_composite(Image.new("RGBA", image.size, background), image)
+
+
+class Viewport:
+    def __init__(self, view_width, view_height, min_zoom=1 / 16, max_zoom=32):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.zoom = 1.0
+        self.offset_x = 0.0  # Drawing coordinate shown at the left edge of the view
+        self.offset_y = 0.0
+        self.mip_cache = {}  # (level, column, row) -> (region revision, block image or None)
+
+    # Coordinate mapping
+
+    def to_image(self, x, y):
+        """Drawing pixel under view position (x, y)"""
+        return (math.floor(self.offset_x + x / self.zoom), math.floor(self.offset_y + y / self.zoom))
+
+    def to_view_box(self, box):
+        """View rectangle covering a drawing box, clipped to the view; None if it is off screen"""
+        if box is None:
+            return None
+        x0 = math.floor((box[0] - self.offset_x) * self.zoom)
+        y0 = math.floor((box[1] - self.offset_y) * self.zoom)
+        x1 = math.ceil((box[2] - self.offset_x) * self.zoom)
+        y1 = math.ceil((box[3] - self.offset_y) * self.zoom)
+        return intersect_box((x0, y0, x1, y1), (0, 0, self.view_width, self.view_height))
+
+    def is_identity(self):
+        return self.zoom == 1 and self.offset_x == 0 and self.offset_y == 0
+
+    # Navigation
+
+    def zoom_at(self, factor, x, y):
+        """Multiply the zoom by factor, keeping the drawing point under view position (x, y) still"""
+        zoom = min(self.max_zoom, max(self.min_zoom, self.zoom * factor))
+        image_x = self.offset_x + x / self.zoom
+        image_y = self.offset_y + y / self.zoom
+        self.zoom = zoom
+        self.offset_x = image_x - x / zoom
+        self.offset_y = image_y - y / zoom
+
+    def pan(self, dx, dy):
+        """Move the drawing by (dx, dy) view pixels"""
+        self.offset_x -= dx / self.zoom
+        self.offset_y -= dy / self.zoom
+
+    def reset(self):
+        self.zoom = 1.0
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+
+    # Rendering
+
+    def render(self, canvas, view_box=None, background=None):
+        """Render the part of the view inside view_box (the whole view by default) as an RGBA image,
+        over the background color if one is given"""
+        view_box = view_box or (0, 0, self.view_width, self.view_height)
+        width, height = view_box[2] - view_box[0], view_box[3] - view_box[1]
+
+        # Fast path: 1:1 with an integer offset is a plain crop
+        if self.zoom == 1 and self.offset_x == int(self.offset_x) and self.offset_y == int(self.offset_y):
+            box = (view_box[0] + int(self.offset_x), view_box[1] + int(self.offset_y),
+                   view_box[2] + int(self.offset_x), view_box[3] + int(self.offset_y))
+            inside = intersect_box(box, (0, 0) + canvas.size)
+            if inside == box:
+                return under(canvas.crop(box), background)
+
+        result = Image.new("RGBA", (width, height), OUTSIDE)
+        drawing = self.to_view_box((0, 0) + canvas.size)
+        inside = drawing and intersect_box(drawing, view_box)
+        if inside is None:
+            return result
+
+        # Pick the mip level that is at most 2x larger than the displayed scale
+        level = 0
+        if self.zoom < 1:
+            level = min(int(math.log2(1 / self.zoom)), MIP_LEVELS)
+
+        for row in range(inside[1] // SQUARE, (inside[3] - 1) // SQUARE + 1):
+            for column in range(inside[0] // SQUARE, (inside[2] - 1) // SQUARE + 1):
+                square = (column * SQUARE, row * SQUARE, (column + 1) * SQUARE, (row + 1) * SQUARE)
+                square = intersect_box(square, drawing)
+                part = intersect_box(square, inside)
+                image = self._render_square(canvas, level, square)
+                if part != square:
+                    image = image.crop((part[0] - square[0], part[1] - square[1],
+                                        part[2] - square[0], part[3] - square[1]))
+                result.paste(under(image, background), (part[0] - view_box[0], part[1] - view_box[1]))
+        return result
+
+    def _render_square(self, canvas, level, square):
+        """The drawing inside a view rectangle, scaled from mip level `level`"""
+        scale = 2 ** level
+
+        # Source rectangle at that level, in floats, and the whole pixels around it plus as many as the
+        # filter reaches past its edge, so neighbouring squares blend into each other without a seam
+        sx0 = (self.offset_x + square[0] / self.zoom) / scale
+        sy0 = (self.offset_y + square[1] / self.zoom) / scale
+        sx1 = (self.offset_x + square[2] / self.zoom) / scale
+        sy1 = (self.offset_y + square[3] / self.zoom) / scale
+        pad = math.ceil(1 / (self.zoom * scale)) + 1
+        source_box = (math.floor(sx0) - pad, math.floor(sy0) - pad, math.ceil(sx1) + pad, math.ceil(sy1) + pad)
+        source = Image.new("RGBA", (source_box[2] - source_box[0], source_box[3] - source_box[1]), BLANK)
+        # Past the edge of the drawing is blank, whatever edge tiles hold out there
+        level_size = (0, 0, math.ceil(canvas.width / scale), math.ceil(canvas.height / scale))
+        on_drawing = intersect_box(source_box, level_size)
+        if on_drawing is not None:
+            source.paste(self._compose(canvas, level, on_drawing),
+                         (on_drawing[0] - source_box[0], on_drawing[1] - source_box[1]))
+
+        size = (square[2] - square[0], square[3] - square[1])
+        resample = Image.NEAREST if self.zoom * scale >= 1 else Image.BILINEAR
+        return source.resize(size, resample, box=(sx0 - source_box[0], sy0 - source_box[1],
+                                                  sx1 - source_box[0], sy1 - source_box[1]))
+
+    def _compose(self, canvas, level, box):
+        """Like canvas.crop(box) but at 1/2**level scale, box being in level coordinates"""
+        if level == 0:
+            return canvas.crop(box)
+        size = canvas.tile_size
+        image = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), BLANK)
+        last_column = (math.ceil(canvas.width / 2 ** level) - 1) // size
+        last_row = (math.ceil(canvas.height / 2 ** level) - 1) // size
+        for row in range(max(0, box[1] // size), min(last_row, (box[3] - 1) // size) + 1):
+            for column in range(max(0, box[0] // size), min(last_column, (box[2] - 1) // size) + 1):
+                block = self._block(canvas, level, column, row)
+                if block is not None:
+                    image.paste(block, (column * size - box[0], row * size - box[1]))
+        return image
+
+    def _block(self, canvas, level, column, row):
+        """Tile-sized block of mip level `level`, or None if nothing was ever drawn inside it"""
+        if level == 0:
+            return canvas.get((column, row))
+        revision = canvas.region_revisions.get((level, column, row))
+        if revision is None:
+            return None
+        cached = self.mip_cache.get((level, column, row))
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+
+        # Halve the 2x2 blocks of the level below
+        size = canvas.tile_size
+        block = None
+        children = [(dx, dy, self._block(canvas, level - 1, column * 2 + dx, row * 2 + dy))
+                    for dy in (0, 1) for dx in (0, 1)]
+        if any(child is not None for _, _, child in children):
+            joined = Image.new("RGBA", (size * 2, size * 2), BLANK)
+            for dx, dy, child in children:
+                if child is not None:
+                    joined.paste(child, (dx * size, dy * size))
+            block = joined.reduce(2)
+        self.mip_cache[(level, column, row)] = (revision, block)
+        return block
@@ -0,0 +1,45 @@
+"""Shared helpers for the round-trip tests; run with python -m pytest from the repository root."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import ImageChops  # noqa: E402
+
+from doodle_engine import DoodleEngine  # noqa: E402
+
+OPERATIONS = [
+    {"op": "stroke", "tool": "brush", "color": "#FF5555", "size": 5, "hardness": 1.0,
+     "points": [10, 10, 60, 40, 120, 30, 150, 90]},
+    {"op": "fill_background", "color": "#FFFFFF"},
+    {"op": "add_layer", "name": "Sky"},
+    {"op": "stroke", "tool": "brush", "color": "#5555FF", "size": 20, "hardness": 0.5,
+     "points": [20, 150, 90, 110, 180, 170]},
+    {"op": "fill_shape", "color": "#55FF55", "x": 5, "y": 190, "tolerance": 50},
+    {"op": "layer_opacity", "index": 1, "opacity": 0.5},
+    {"op": "select_layer", "index": 0},
+    {"op": "stroke", "tool": "eraser", "color": "#000000", "size": 10, "hardness": 1.0,
+     "points": [0, 20, 199, 20]},
+]
+
+
+def identical(a, b):
+    """True if two RGBA images have exactly the same pixels"""
+    return a.size == b.size and ImageChops.difference(a, b).getbbox(alpha_only=False) is None
+
+
+def same_document(a, b):
+    """True if two engines show the same drawing, layers and background"""
+    return (identical(a.image, b.image) and a.background == b.background
+            and [(layer.name, layer.visible, layer.opacity) for layer in a.layers]
+            == [(layer.name, layer.visible, layer.opacity) for layer in b.layers])
+
+
+@pytest.fixture
+def drawing():
+    """A 200x200 engine with OPERATIONS applied"""
+    engine = DoodleEngine(200, 200)
+    engine.replay(OPERATIONS)
+    return engine
@@ -0,0 +1,96 @@
+import asyncio
+import math
+import struct
+
+import pytest
+
+from conftest import identical
+from doodle_collab import (ERROR, HELLO, OPS, VERSION, Session, SessionServer, decode_batch, decode_operation,
+                           decode_ordered, decode_snapshot, encode_batch, encode_operation, encode_ordered,
+                           encode_snapshot, frame, read_frame)
+from doodle_engine import DoodleEngine
+
+OPERATIONS = [
+    {"op": "stroke", "tool": "brush", "color": "#FF5555", "size": 5.0, "hardness": 1.0,
+     "points": [10, 10, 12, 9, -3, 400, 60000, 0]},
+    {"op": "stroke", "tool": "eraser", "color": "#00000080", "size": 2.5, "hardness": 0.25, "points": [7, 8]},
+    {"op": "stroke", "tool": "brush", "color": "#123456", "size": 10.0, "hardness": 0.5,
+     "points": [1.5, 2.25, 3.0, 4.75]},
+    {"op": "fill_shape", "color": "#55FF55", "x": 120, "y": -4, "tolerance": 50},
+    {"op": "fill_background", "color": "#FFFFFF"},
+    {"op": "fill_background", "color": None},
+    {"op": "clear"},
+]
+
+
+@pytest.mark.parametrize("operation", OPERATIONS, ids=lambda operation: operation["op"])
+def test_operation_round_trip(operation):
+    assert decode_operation(encode_operation(operation)) == operation
+
+
+def test_batches_keep_order():
+    encoded = [encode_operation(operation) for operation in OPERATIONS]
+    assert decode_batch(encode_batch(encoded)) == encoded
+    first, entries = decode_ordered(encode_ordered([(41 + i, i % 3, data) for i, data in enumerate(encoded)]))
+    assert first == 41
+    assert entries == [(i % 3, operation) for i, operation in enumerate(OPERATIONS)]
+
+
+def test_snapshot_round_trip(drawing):
+    sequence, background, canvas = decode_snapshot(encode_snapshot(7, drawing))
+    assert (sequence, background) == (7, drawing.background)
+    assert identical(canvas.to_image(), drawing.canvas.to_image())
+
+
+@pytest.mark.parametrize("change", [{"size": math.nan}, {"size": 1e9}, {"hardness": 2.0},
+                                    {"points": [0.0, math.inf]}])
+def test_out_of_range_strokes_are_refused(change):
+    operation = dict(OPERATIONS[0], **change)
+    with pytest.raises(ValueError):
+        decode_operation(encode_operation(operation))
+
+
+def test_truncated_operation_is_refused():
+    with pytest.raises(ValueError):
+        decode_operation(encode_operation(OPERATIONS[0])[:-1])
+
+
+def test_server_says_why_it_refuses_an_operation():
+    async def send_refused_operation():
+        server = SessionServer(200, 200)
+        await server.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        try:
+            writer.write(frame(HELLO, struct.pack(">H", VERSION)))
+            writer.write(frame(OPS, encode_batch([encode_operation(dict(OPERATIONS[0], size=1e9))])))
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == ERROR:
+                    return payload.decode("utf-8")
+        finally:
+            writer.close()
+            await server.close()
+
+    assert "out of range" in asyncio.run(asyncio.wait_for(send_refused_operation(), 10))
+
+
+def test_pending_operations_outlive_the_history_budget():
+    # A budget this small would otherwise drop all but the newest undo entry
+    session = Session(DoodleEngine(200, 200, history_budget=1))
+    session.incoming.append(("welcome", 1))
+    session.sync()
+    mine = [{"op": "stroke", "tool": "brush", "color": "#FF5555", "size": 20.0, "hardness": 1.0,
+             "points": [10, 20 * i, 190, 20 * i + 30]} for i in range(1, 6)]
+    for operation in mine:
+        session.engine.apply(operation)
+    assert len(session.engine.history.undo_stack) == len(mine)
+
+    # Another peer's fill was numbered first, so it goes under this peer's strokes
+    theirs = {"op": "fill_shape", "color": "#5555FF", "x": 5, "y": 5, "tolerance": 50}
+    session.incoming.append(("ordered", 1, [(2, theirs)] + [(1, operation) for operation in mine]))
+    session.sync()
+    assert not session.pending and session.engine.history.keep_from is None
+
+    reference = DoodleEngine(200, 200)
+    reference.replay([theirs] + mine)
+    assert identical(session.engine.image, reference.image)
@@ -0,0 +1,39 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from doodle_engine import DoodleEngine
+from doodle_fill import flood_fill
+
+
+def divided(line):
+    """A white 40x20 image cut in two by a vertical line of the given colour"""
+    image = Image.new("RGBA", (40, 20), (255, 255, 255, 255))
+    ImageDraw.Draw(image).line([(20, 0), (20, 19)], fill=line)
+    return image
+
+
+@pytest.mark.parametrize("line, tolerance, crosses", [
+    ((170, 170, 170, 255), 254, False),  # 255 away from white, just past where 8-bit sums clip
+    ((170, 170, 170, 255), 255, True),
+    ((0, 0, 0, 255), 300, False),
+    ((0, 0, 0, 255), 764, False),
+    ((0, 0, 0, 255), 765, True),
+    ((0, 0, 0, 0), 1019, False),  # Transparent is as far from opaque white as a colour gets
+    ((0, 0, 0, 0), 1020, True),
+])
+def test_tolerance_is_the_whole_summed_difference(line, tolerance, crosses):
+    image = divided(line)
+    assert flood_fill(image, (0, 0), (255, 0, 0, 255), tolerance) is not None
+    assert (image.getpixel((39, 0)) == (255, 0, 0, 255)) == crosses
+
+
+def test_engine_fill_crosses_a_line_within_tolerance():
+    # On a transparent layer an opaque black line is 255 away
+    engine = DoodleEngine(200, 200)
+    engine.apply({"op": "stroke", "tool": "brush", "color": "#000000", "size": 3, "hardness": 1.0,
+                  "points": [100, 0, 100, 199]})
+    engine.apply({"op": "fill_shape", "color": "#FF0000", "x": 10, "y": 10, "tolerance": 254})
+    assert engine.image.getpixel((190, 10)) != engine.image.getpixel((10, 10))
+    engine.undo()
+    engine.apply({"op": "fill_shape", "color": "#FF0000", "x": 10, "y": 10, "tolerance": 255})
+    assert engine.image.getpixel((190, 10)) == engine.image.getpixel((10, 10))
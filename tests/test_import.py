@@ -0,0 +1,30 @@
+from PIL import Image
+
+from conftest import OPERATIONS, same_document
+from doodle_engine import DoodleEngine
+
+
+def test_layer_changes_during_an_import_replay(tmp_path):
+    # The app finishes a paste in progress before any layer change, so the import is recorded first
+    path = str(tmp_path / "photo.png")
+    image = Image.new("RGBA", (120, 90), (40, 160, 220, 255))
+    image.save(path)
+    engine = DoodleEngine(200, 200)
+    engine.replay(OPERATIONS)
+    engine.start_recording()
+    engine.begin_import("photo.png")
+    engine.import_rows(image, (30, 50), 0, 40)
+
+    engine.import_rows(image, (30, 50), 40, image.height)
+    engine.end_import(image, (30, 50), path)
+    engine.add_layer()
+    engine.move_layer(engine.layers.active, engine.layers.active - 1)
+    engine.set_layer_visible(engine.layers.active, False)
+    engine.set_layer_opacity(1, 0.25)
+    operations = engine.stop_recording()
+    assert [operation["op"] for operation in operations][0] == "import_image"
+
+    replayed = DoodleEngine(200, 200)
+    replayed.replay(OPERATIONS + operations)
+    assert same_document(engine, replayed)
+    assert replayed.layers.active == engine.layers.active
@@ -0,0 +1,50 @@
+import time
+
+from conftest import OPERATIONS, same_document
+from doodle_engine import DoodleEngine
+from doodle_journal import Journal
+
+
+def crash(journal):
+    """Leave the journal on disk as a process that died would: written, unlocked, not discarded"""
+    journal.close()
+
+
+def test_recover_after_crash(tmp_path):
+    journal = Journal(str(tmp_path), checkpoint_every=5)  # Some operations in a checkpoint, some only logged
+    engine = DoodleEngine(200, 200)
+    journal.attach(engine)
+    engine.replay(OPERATIONS[:4])
+    engine.undo()
+    engine.replay(OPERATIONS[4:])
+    log_path = journal.log_path
+    crash(journal)
+    # A line cut short by the crash is ignored
+    with open(log_path, "rb") as f:
+        assert f.read().count(b"\n") > 0  # Recovery has to replay from the log, not only load the checkpoint
+    with open(log_path, "ab") as f:
+        f.write(b'{"op": "stroke", "tool": "br')
+
+    restarted = Journal(str(tmp_path))
+    assert restarted.exists()
+    recovered = DoodleEngine(200, 200)
+    assert restarted.recover(recovered)
+    assert same_document(recovered, engine)
+    restarted.close(discard=True)
+    assert not Journal(str(tmp_path)).exists()
+
+
+def test_running_journal_is_not_offered(tmp_path):
+    journal = Journal(str(tmp_path))
+    engine = DoodleEngine(200, 200)
+    journal.attach(engine)
+    engine.replay(OPERATIONS)
+    time.sleep(0.1)
+
+    other = Journal(str(tmp_path))
+    assert not other.exists()
+    other.attach(DoodleEngine(200, 200))
+    other.close(discard=True)
+
+    journal.close(discard=True)
+    assert not Journal(str(tmp_path)).exists()
@@ -0,0 +1,54 @@
+import os
+
+from conftest import same_document
+from doodle_engine import DoodleEngine
+from doodle_project import Project, open_project
+
+
+def reopen(path):
+    engine = DoodleEngine(10, 10)
+    project = open_project(str(path), engine)
+    return engine, project
+
+
+def test_save_and_open(drawing, tmp_path):
+    path = tmp_path / "drawing.doodle"
+    Project(str(path)).save(drawing)
+
+    opened, _ = reopen(path)
+    assert same_document(opened, drawing)
+
+
+def test_undo_and_redo_survive_a_save(drawing, tmp_path):
+    path = tmp_path / "drawing.doodle"
+    drawing.undo()  # Leave something to redo as well
+    Project(str(path)).save(drawing)
+    opened, _ = reopen(path)
+
+    for _ in range(len(drawing.history.undo_stack)):
+        drawing.undo()
+        opened.undo()
+        assert same_document(opened, drawing)
+    for _ in range(len(drawing.history.redo_stack)):
+        drawing.redo()
+        opened.redo()
+        assert same_document(opened, drawing)
+
+
+def test_incremental_save_appends_only_changes(drawing, tmp_path):
+    path = tmp_path / "drawing.doodle"
+    Project(str(path)).save(drawing)
+    size = os.path.getsize(path)
+
+    opened, project = reopen(path)
+    opened.apply({"op": "stroke", "tool": "brush", "color": "#000000", "size": 2, "hardness": 1.0,
+                  "points": [100, 100, 110, 110]})
+    project.save(opened)
+    # The unchanged tiles and patches are not written again
+    assert size < os.path.getsize(path) < 2 * size
+
+    again, _ = reopen(path)
+    assert same_document(again, opened)
+    again.undo()
+    opened.undo()
+    assert same_document(again, opened)